@@ -0,0 +1,50 @@
+import argparse
+import os
+import sys
+
+from descargas_youtube.cache import CACHE_DIR
+
+from .suite import LENGTHS, QUICK_LENGTHS, STEPS, compare, default_cases, run_suite
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Mide decodificación, análisis, render, vista previa y exportación sobre pistas sintéticas.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="generar las pistas y medir")
+    run.add_argument("-o", "--output", default="benchmark.json", help="archivo JSON de resultados")
+    run.add_argument("--lengths", type=lambda v: [float(s) for s in v.split(",")], default=LENGTHS,
+                     help="duraciones en segundos, p. ej. 30,300 (por defecto 30 s a 2 h)")
+    run.add_argument("--quick", action="store_true", help=f"solo {', '.join(f'{s} s' for s in QUICK_LENGTHS)}")
+    run.add_argument("--kinds", default="click,ramp", type=lambda v: v.split(","),
+                     help="click (tempo fijo), ramp (tempo que cambia) o ambos")
+    run.add_argument("--steps", default=",".join(STEPS), type=lambda v: v.split(","), help="etapas a medir")
+    run.add_argument("--format", default="mp3", choices=("mp3", "wav"), help="formato de las pistas")
+    run.add_argument("--repeat", type=int, default=1, help="repeticiones por etapa (se toma la mediana)")
+    run.add_argument("--work-dir", default=os.path.join(CACHE_DIR, "benchmarks"),
+                     help="dónde se guardan las pistas generadas entre ejecuciones")
+
+    diff = commands.add_parser("compare", help="comparar dos ejecuciones")
+    diff.add_argument("baseline", help="resultados de referencia")
+    diff.add_argument("current", help="resultados nuevos")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        lengths = QUICK_LENGTHS if args.quick else args.lengths
+        run_suite(default_cases(lengths, args.kinds), args.work_dir, args.output, args.format, args.repeat, args.steps)
+        print(f"Resultados guardados en {args.output}")
+    else:
+        regressions = compare(args.baseline, args.current)
+        if regressions:
+            print(f"{len(regressions)} regresiones:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+
+
+# Steps run in spawned processes, which import this module again.
+if __name__ == "__main__":
+    main()
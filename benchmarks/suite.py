@@ -0,0 +1,249 @@
+import collections
+import concurrent.futures
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+import numpy as np
+
+from descargas_youtube.analysis import (
+    HOP_LENGTH, analyze_audio, beat_agreement, librosa, onset_path, stitch_segments, track_segment, warm_up,
+)
+from descargas_youtube.beatgrid import BeatGrid
+from descargas_youtube.engine import beat_grid
+from descargas_youtube.metrics import Span, collect, peak_rss
+from descargas_youtube.pcm import ensure_pcm, open_pcm, pcm_path
+from descargas_youtube.render import PREVIEW_SECONDS, RENDER_SR, render_chunks, render_window, render_with_metronome
+from descargas_youtube.waveform import peaks_path
+
+from .synth import Case
+
+LENGTHS = (30, 300, 1800, 7200)
+QUICK_LENGTHS = (30, 300)
+STEPS = ("decode", "analysis", "render", "preview", "export")
+VOLUME = -20
+# A step this much slower than in the baseline, or a beat F-measure this much
+# lower, counts as a regression in ``compare``.
+SLOWDOWN = 0.10
+ACCURACY_DROP = 0.02
+
+
+def default_cases(lengths=LENGTHS, kinds=("click", "ramp")):
+    cases = []
+    for seconds in lengths:
+        if "click" in kinds:
+            cases.append(Case("click", seconds, bpm=120))
+        if "ramp" in kinds:
+            cases.append(Case("ramp", seconds, bpm=90, end_bpm=150))
+    return cases
+
+
+# The steps below run in a fresh worker process each, so peak RSS is theirs alone.
+
+def step_decode(audio_file):
+    for path in (pcm_path(audio_file), onset_path(audio_file), peaks_path(audio_file)):
+        if os.path.exists(path):
+            os.unlink(path)
+    ensure_pcm(audio_file)
+
+
+def step_analysis(audio_file):
+    # What the server does, with the segments tracked one after another.
+    result = analyze_audio(audio_file, segmented=True)
+    if 'segments' in result:
+        segments = result.pop('segments')
+        result.update(stitch_segments([track_segment(result['onset_file'], b) for b in segments], segments))
+    return result
+
+
+def step_render(audio_file, grid):
+    for _ in render_chunks(open_pcm(pcm_path(audio_file)), BeatGrid.from_dict(grid), VOLUME):
+        pass
+
+
+def step_preview(audio_file, grid):
+    pcm = open_pcm(pcm_path(audio_file))
+    frames = min(PREVIEW_SECONDS * RENDER_SR, len(pcm))
+    with Span("preview", track_seconds=len(pcm) / RENDER_SR) as span:
+        span.bytes = render_window(pcm, BeatGrid.from_dict(grid), VOLUME, (len(pcm) - frames) // 2, frames).nbytes
+
+
+def step_export(audio_file, grid):
+    output_file = f"{os.path.splitext(audio_file)[0]}.metronome.mp3"
+    try:
+        render_with_metronome(audio_file, BeatGrid.from_dict(grid), VOLUME, {"mp3": output_file})
+    finally:
+        if os.path.exists(output_file):
+            os.unlink(output_file)
+
+
+def _prepare():
+    # Imports librosa and loads its compiled kernels before anything is timed.
+    warm_up()
+
+
+def _measure(fn, *args):
+    baseline = peak_rss()
+    started, cpu = time.perf_counter(), time.process_time()
+    result, spans = collect(None, fn, *args)
+    stages = collections.defaultdict(lambda: {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'bytes': 0})
+    for span in spans:
+        stage = stages[span['stage']]
+        stage['wall_seconds'] += span['wall_seconds']
+        stage['cpu_seconds'] += span['cpu_seconds'] + span['child_cpu_seconds']
+        stage['bytes'] += span['bytes']
+    measured = {
+        'wall_seconds': time.perf_counter() - started,
+        'cpu_seconds': time.process_time() - cpu + sum(s['child_cpu_seconds'] for s in spans),
+        'peak_rss_bytes': peak_rss(),
+        'baseline_rss_bytes': baseline,
+        'spans': dict(stages),
+    }
+    return measured, result
+
+
+def run_step(fn, *args):
+    """Run one step in a new spawned process; return ``(measurements, result)``."""
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context("spawn"), initializer=_prepare,
+    ) as pool:
+        return pool.submit(_measure, fn, *args).result()
+
+
+def _median_run(fn, args, repeat):
+    runs = [run_step(fn, *args) for _ in range(repeat)]
+    measured = [m for m, _ in runs]
+    best = dict(measured[0])
+    for key in ('wall_seconds', 'cpu_seconds'):
+        best[key] = round(statistics.median(m[key] for m in measured), 4)
+    best['peak_rss_bytes'] = max(m['peak_rss_bytes'] for m in measured)
+    best['step_rss_bytes'] = max(0, best['peak_rss_bytes'] - best['baseline_rss_bytes'])
+    return best, runs[-1][1]
+
+
+def accuracy(case, result):
+    """How close the analysis got to the tempo and beats the track was built with."""
+    truth = case.beat_times()
+    frame_seconds = result.get('hop_length', HOP_LENGTH) / result['sr']
+    tracked = np.asarray(result['beat_frames']) * frame_seconds
+    grid = beat_grid(result)
+    true_bpm = float(case.tempo_at(case.seconds / 2))
+    tempo_map = result.get('tempo_map') or [(0.0, result['tempo'])]
+    # Each local tempo is compared with the true tempo in the middle of its span.
+    ends = [t for t, _ in tempo_map[1:]] + [result['duration']]
+    centres = [(t + end) / 2 for (t, _), end in zip(tempo_map, ends)]
+    ratio = result['tempo'] / true_bpm
+    return {
+        'true_bpm': round(true_bpm, 2),
+        'bpm': round(result['tempo'], 2),
+        'bpm_error': round(abs(result['tempo'] - true_bpm), 3),
+        'octave_error': bool(abs(ratio - 0.5) < 0.04 or abs(ratio - 2) < 0.08),
+        'tempo_map_error': round(float(np.mean(np.abs(
+            np.array([b for _, b in tempo_map]) - case.tempo_at(np.array(centres))
+        ))), 3),
+        'beat_f_measure': round(beat_agreement(truth, tracked), 4),
+        'grid_f_measure': round(beat_agreement(truth, grid.times()), 4),
+    }
+
+
+def run_case(case, work_dir, fmt="mp3", repeat=1, steps=STEPS):
+    """Build the track of ``case`` and time every step on it."""
+    audio_file = case.build(work_dir, fmt)
+    report = {'name': case.name, 'kind': case.kind, 'seconds': case.seconds, 'format': fmt, 'steps': {}}
+    # Later steps need the decoded artifact and the analysis, whatever ``steps`` asks for.
+    measured, _ = _median_run(step_decode, (audio_file,), repeat)
+    if "decode" in steps:
+        report['steps']['decode'] = measured
+    measured, result = _median_run(step_analysis, (audio_file,), repeat)
+    if "analysis" in steps:
+        report['steps']['analysis'] = measured
+    report['accuracy'] = accuracy(case, result)
+    grid = beat_grid(result).to_dict()
+    for name, fn in (("render", step_render), ("preview", step_preview), ("export", step_export)):
+        if name in steps:
+            report['steps'][name], _ = _median_run(fn, (audio_file, grid), repeat)
+    return report
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'librosa': librosa.__version__,
+        'commit': _git_commit(),
+    }
+
+
+def run_suite(cases, work_dir, output, fmt="mp3", repeat=1, steps=STEPS):
+    """Run every case and write the results to ``output`` as JSON, after each case."""
+    results = {
+        'created': datetime.datetime.now().isoformat(timespec="seconds"),
+        'environment': environment(),
+        'repeat': repeat,
+        'cases': [],
+    }
+    for case in cases:
+        print(f"[bench] {case.name}...")
+        report = run_case(case, work_dir, fmt, repeat, steps)
+        results['cases'].append(report)
+        timings = ", ".join(f"{name} {m['wall_seconds']:.2f} s" for name, m in report['steps'].items())
+        acc = report['accuracy']
+        print(f"[bench] {case.name}: {timings}; {acc['bpm']} BPM (real {acc['true_bpm']}), "
+              f"F {acc['grid_f_measure']:.3f}")
+        with open(f"{output}.part", "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        os.replace(f"{output}.part", output)
+    return results
+
+
+def compare(baseline_file, current_file, slowdown=SLOWDOWN, accuracy_drop=ACCURACY_DROP):
+    """Print how ``current_file`` differs from ``baseline_file``; return the regressions found."""
+    with open(baseline_file, encoding="utf-8") as f:
+        baseline = {case['name']: case for case in json.load(f)['cases']}
+    with open(current_file, encoding="utf-8") as f:
+        current = json.load(f)['cases']
+    regressions = []
+    for case in current:
+        old = baseline.get(case['name'])
+        if old is None:
+            print(f"{case['name']}: sin referencia")
+            continue
+        print(case['name'])
+        for step, measured in case['steps'].items():
+            before = old['steps'].get(step)
+            if before is None:
+                continue
+            change = measured['wall_seconds'] / before['wall_seconds'] - 1 if before['wall_seconds'] else 0.0
+            memory = (measured['step_rss_bytes'] - before['step_rss_bytes']) / 1024 ** 2
+            flag = ""
+            if change > slowdown:
+                flag = "  << más lento"
+                regressions.append(f"{case['name']} {step}: {change:+.0%}")
+            print(f"  {step:<9} {before['wall_seconds']:9.3f} s -> {measured['wall_seconds']:9.3f} s "
+                  f"({change:+6.1%})  memoria {memory:+8.1f} MB{flag}")
+        for key in ('beat_f_measure', 'grid_f_measure'):
+            before, after = old['accuracy'][key], case['accuracy'][key]
+            flag = ""
+            if before - after > accuracy_drop:
+                flag = "  << menos preciso"
+                regressions.append(f"{case['name']} {key}: {before:.3f} -> {after:.3f}")
+            print(f"  {key:<15} {before:.3f} -> {after:.3f}{flag}")
+        print(f"  bpm             {old['accuracy']['bpm']} -> {case['accuracy']['bpm']} "
+              f"(real {case['accuracy']['true_bpm']})")
+    return regressions
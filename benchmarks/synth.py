@@ -0,0 +1,120 @@
+import os
+import wave
+
+import numpy as np
+
+from descargas_youtube.audio import encode_mp3
+from descargas_youtube.pcm import PCM_CHANNELS, PCM_SR
+
+# Seconds of audio generated and written per step, so a 2 h track never sits in memory.
+BLOCK_SECONDS = 60
+CLICK_SECONDS = 0.03
+NOISE_LEVEL = 0.01
+
+
+def constant_beats(bpm, seconds, first=0.25):
+    """Beat times of a steady ``bpm`` click train."""
+    return np.arange(first, seconds, 60.0 / bpm)
+
+
+def ramp_beats(start_bpm, end_bpm, seconds, first=0.25):
+    """Beat times of a tempo that moves linearly from ``start_bpm`` to ``end_bpm``."""
+    times = [first]
+    while True:
+        t = times[-1]
+        bpm = start_bpm + (end_bpm - start_bpm) * t / seconds
+        t += 60.0 / bpm
+        if t >= seconds:
+            return np.asarray(times)
+        times.append(t)
+
+
+def ramp_tempo(start_bpm, end_bpm, seconds, t):
+    """The true tempo of a ramp at time ``t``."""
+    return start_bpm + (end_bpm - start_bpm) * np.asarray(t) / seconds
+
+
+def _click(sr):
+    # A short decaying 1 kHz blip, distinct from the 880 Hz metronome click.
+    n = int(CLICK_SECONDS * sr)
+    t = np.arange(n) / sr
+    return (np.sin(2 * np.pi * 1000 * t) * np.exp(-t * 120)).astype(np.float32)
+
+
+def click_blocks(beat_times, seconds, sr=PCM_SR, seed=0, block_size=None):
+    """Yield a mono click track as float32 blocks of ``block_size`` samples (a minute by default).
+
+    Every beat gets a click over faint, seeded noise; every fourth beat is accented.
+    """
+    rng = np.random.default_rng(seed)
+    click = _click(sr)
+    offsets = np.round(np.asarray(beat_times) * sr).astype(np.int64)
+    gains = np.where(np.arange(len(offsets)) % 4 == 0, 0.9, 0.6).astype(np.float32)
+    total = int(seconds * sr)
+    block_size = block_size or BLOCK_SECONDS * sr
+    for start in range(0, total, block_size):
+        stop = min(total, start + block_size)
+        block = rng.normal(0, NOISE_LEVEL, stop - start).astype(np.float32)
+        first, last = np.searchsorted(offsets, [start - len(click), stop])
+        for offset, gain in zip(offsets[first:last], gains[first:last]):
+            lo, hi = max(offset, start), min(offset + len(click), stop)
+            block[lo - start:hi - start] += gain * click[lo - offset:hi - offset]
+        yield block
+
+
+def write_click_track(path, beat_times, seconds, sr=PCM_SR, seed=0):
+    """Write :func:`click_blocks` as a stereo 16-bit WAV.
+
+    The same arguments always produce the same file, so runs on different
+    days measure the same input.
+    """
+    partial = f"{path}.part"
+    with wave.open(partial, "wb") as out:
+        out.setnchannels(PCM_CHANNELS)
+        out.setsampwidth(2)
+        out.setframerate(sr)
+        for block in click_blocks(beat_times, seconds, sr, seed):
+            pcm = (np.clip(block, -1.0, 1.0) * 32767).astype(np.int16)
+            out.writeframes(np.repeat(pcm[:, None], PCM_CHANNELS, axis=1).tobytes())
+    os.replace(partial, path)
+    return path
+
+
+class Case:
+    """One synthetic track: a steady click train or a tempo ramp of ``seconds``."""
+
+    def __init__(self, kind, seconds, bpm=120.0, end_bpm=None):
+        self.kind = kind
+        self.seconds = seconds
+        self.bpm = bpm
+        self.end_bpm = end_bpm
+
+    @property
+    def name(self):
+        if self.kind == "ramp":
+            return f"ramp-{self.bpm:g}-{self.end_bpm:g}bpm-{self.seconds:g}s"
+        return f"click-{self.bpm:g}bpm-{self.seconds:g}s"
+
+    def beat_times(self):
+        if self.kind == "ramp":
+            return ramp_beats(self.bpm, self.end_bpm, self.seconds)
+        return constant_beats(self.bpm, self.seconds)
+
+    def tempo_at(self, t):
+        if self.kind == "ramp":
+            return ramp_tempo(self.bpm, self.end_bpm, self.seconds, t)
+        return np.full(np.shape(t), self.bpm)
+
+    def build(self, work_dir, fmt="mp3"):
+        """Path of the track in ``fmt`` ("wav" or "mp3"), generated on first use."""
+        os.makedirs(work_dir, exist_ok=True)
+        wav_file = os.path.join(work_dir, f"{self.name}.wav")
+        if not os.path.exists(wav_file):
+            write_click_track(wav_file, self.beat_times(), self.seconds)
+        if fmt == "wav":
+            return wav_file
+        mp3_file = os.path.join(work_dir, f"{self.name}.mp3")
+        if not os.path.exists(mp3_file):
+            encode_mp3(wav_file, f"{mp3_file}.part.mp3")
+            os.replace(f"{mp3_file}.part.mp3", mp3_file)
+        return mp3_file
@@ -0,0 +1,5 @@
+from .cli import main
+
+# Worker processes are spawned and re-import this module; only the parent runs.
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+import functools
+import os
+import time
+
+import numpy as np
+
+from .beatgrid import BeatGrid, fit_beats
+from .cache import CACHE_DIR
+from .jobs import check
+from .lazy import lazy_import
+from .metrics import Span
+from .pcm import PCM_CHANNELS, PCM_SR, artifact_path, ensure_pcm, open_pcm
+from .progress import throttled
+from .waveform import PeakBuilder, peaks_path
+
+# librosa compiles its beat tracker with numba's cache=True. Keeping that cache
+# in a writable directory shared by every process lets each one load the
+# compiled code instead of compiling it again; child processes inherit this.
+os.environ.setdefault("NUMBA_CACHE_DIR", os.path.join(CACHE_DIR, "numba"))
+librosa = lazy_import("librosa")
+
+# Analysis reads the shared PCM artifact at its native rate with librosa's
+# default window and hop: ~86 onset frames per second. Tempo bins are a lag
+# of whole frames apart, so a coarser hop would cost tempo resolution.
+ANALYSIS_SR = PCM_SR
+N_FFT = 2048
+HOP_LENGTH = 512
+# Audio read per step in streaming mode (~30 s).
+BLOCK_SIZE = 2582 * HOP_LENGTH
+# Tempogram window (librosa's default) and the onset frames averaged into
+# each column of the stored tempogram (~10 s).
+TEMPOGRAM_WIN = 384
+TEMPOGRAM_STEP = 862
+TEMPO_RANGE = (30, 300)
+# Long tracks are beat-tracked in segments of ~2 min overlapping by ~20 s,
+# enough for the tracker to lock on before the part of a segment that is kept.
+SEGMENT_FRAMES = 10336
+SEGMENT_OVERLAP = 1722
+
+
+def _mel_db(y):
+    S = librosa.feature.melspectrogram(
+        y=y, sr=ANALYSIS_SR, n_fft=N_FFT, hop_length=HOP_LENGTH, center=False
+    )
+    return librosa.power_to_db(S, top_db=None)
+
+
+def onset_envelope_stream(blocks):
+    """Onset strength of a signal that arrives as consecutive blocks.
+
+    Mirrors the envelope ``librosa.beat.beat_track`` computes for itself (log
+    mel spectral flux, median over bands, centred frames) while holding only
+    one block plus one FFT window of audio. The dB floor is fixed instead of
+    relative to the loudest frame of the whole track, which is unknown until
+    the end.
+    """
+    envelope = []
+    previous = None
+    # Half a window of silence on both ends reproduces librosa's centred frames.
+    buffer = np.zeros(N_FFT // 2, dtype=np.float32)
+
+    def consume(buffer, previous):
+        n_frames = 1 + (len(buffer) - N_FFT) // HOP_LENGTH if len(buffer) >= N_FFT else 0
+        if n_frames == 0:
+            return buffer, previous
+        S = _mel_db(buffer[:(n_frames - 1) * HOP_LENGTH + N_FFT])
+        reference = np.concatenate([S[:, :1] if previous is None else previous, S[:, :-1]], axis=1)
+        envelope.append(np.median(np.maximum(0.0, S - reference), axis=0))
+        return buffer[n_frames * HOP_LENGTH:], S[:, -1:]
+
+    for block in blocks:
+        buffer, previous = consume(np.concatenate([buffer, block]), previous)
+    consume(np.concatenate([buffer, np.zeros(N_FFT // 2, dtype=np.float32)]), previous)
+    return np.concatenate(envelope) if envelope else np.zeros(1, dtype=np.float32)
+
+
+def mono_blocks(pcm, block_size=BLOCK_SIZE, progress=None, token=None):
+    """Yield a memory-mapped PCM artifact as mono float32 blocks."""
+    for start in range(0, len(pcm), block_size):
+        check(token)
+        if progress is not None:
+            progress(start / len(pcm))
+        yield pcm[start:start + block_size].mean(axis=1, dtype=np.float32) / 32768.0
+
+
+def analyze_audio(audio_file, streaming=True, progress_queue=None, token=None, segmented=False, work_dir=None):
+    """Decode ``audio_file`` and return its duration, tempo and beat frames.
+
+    The file is decoded once into its PCM artifact (see :mod:`.pcm`), which
+    the result points to. Artifacts are written to ``work_dir``, or next to
+    the audio without one; a job that can be cancelled and replaced while
+    it runs needs a directory of its own, as the replacement writes the same
+    names. In streaming mode the artifact is read block by
+    block and only the onset envelope (~86 values per second) is kept, so
+    peak memory does not grow with the length of the track. The waveform
+    peaks (see :mod:`.waveform`) are collected in the same pass.
+
+    ``progress_queue``, if given, receives ``{'stage': 'analysis', 'fraction': f}``
+    events; it is how a worker process reports back to the web session.
+    ``token`` is checked between decode and analysis blocks; whatever a
+    cancelled job leaves in ``work_dir`` is for its caller to remove.
+
+    With ``segmented``, a track long enough to be split is not beat-tracked
+    here: the result carries its ``segments`` instead, to be tracked in
+    parallel with :func:`track_segment` and joined with :func:`stitch_segments`.
+    """
+    progress = None
+    if progress_queue is not None:
+        progress = throttled(lambda fraction: progress_queue.put({'stage': 'analysis', 'fraction': fraction}))
+    pcm_file = ensure_pcm(audio_file, token, work_dir)
+    pcm = open_pcm(pcm_file)
+    n_samples = len(pcm)
+    with Span("onset", track_seconds=n_samples / ANALYSIS_SR) as span:
+        span.bytes = pcm.nbytes
+        peaks = PeakBuilder()
+        if streaming:
+            onset_env = onset_envelope_stream(peaks.tap(mono_blocks(pcm, progress=progress, token=token)))
+        else:
+            y = pcm.mean(axis=1, dtype=np.float32) / 32768.0
+            peaks.add(y)
+            onset_env = librosa.onset.onset_strength(
+                y=y, sr=ANALYSIS_SR, n_fft=N_FFT, hop_length=HOP_LENGTH, aggregate=np.median
+            )
+
+        check(token)
+        tempogram = tempogram_summary(onset_env)
+        onset_file = onset_path(audio_file, work_dir)
+        np.savez(onset_file, onset_env=onset_env, tempogram=tempogram)
+        peaks_file = peaks.save(peaks_path(audio_file, work_dir), onset_env, ANALYSIS_SR / HOP_LENGTH)
+    result = {
+        'duration': n_samples / ANALYSIS_SR,
+        'sr': ANALYSIS_SR,
+        'hop_length': HOP_LENGTH,
+        'tempo_candidates': tempo_candidates(tempogram),
+        'pcm_file': pcm_file,
+        'onset_file': onset_file,
+        'peaks_file': peaks_file,
+    }
+    segments = segment_bounds(len(onset_env))
+    if segmented and len(segments) > 1:
+        result['segments'] = segments
+    else:
+        check(token)
+        result.update(_track(onset_env))
+    return result
+
+
+def artifact_bytes(seconds):
+    """Disk space :func:`analyze_audio` needs for ``seconds`` of audio.
+
+    Nearly all of it is the PCM artifact; the onset envelope and the peaks
+    (a few MB per hour each) are counted at a generous 2 kB per second.
+    """
+    return int(seconds * (PCM_SR * PCM_CHANNELS * 2 + 2048))
+
+
+def _track(onset_env, offset=0):
+    with Span("beat_track", track_seconds=len(onset_env) * HOP_LENGTH / ANALYSIS_SR):
+        tempo, beat_frames = librosa.beat.beat_track(
+            onset_envelope=onset_env, sr=ANALYSIS_SR, hop_length=HOP_LENGTH
+        )
+    # The tracker's tempo is a tempogram bin; the beats it found pin it down.
+    frame_seconds = HOP_LENGTH / ANALYSIS_SR
+    period, _ = fit_beats(np.asarray(beat_frames) * frame_seconds, 60.0 / float(np.atleast_1d(tempo)[0]))
+    return {'tempo': 60.0 / period, 'beat_frames': [int(f) + offset for f in beat_frames]}
+
+
+def segment_bounds(n_frames, length=SEGMENT_FRAMES, overlap=SEGMENT_OVERLAP):
+    """Split ``n_frames`` onset frames into overlapping ``(start, stop)`` segments.
+
+    Tracks shorter than two segments stay whole, and a short tail is folded
+    into the segment before it.
+    """
+    if n_frames <= 2 * length:
+        return [(0, n_frames)]
+    bounds = []
+    for start in range(0, n_frames - overlap, length - overlap):
+        bounds.append((start, min(start + length, n_frames)))
+    if len(bounds) > 1 and bounds[-1][1] - bounds[-1][0] < length // 2:
+        bounds.pop()
+    bounds[-1] = (bounds[-1][0], n_frames)
+    return bounds
+
+
+def track_segment(onset_file, bounds):
+    """Beat-track one segment of a stored onset envelope; frames are absolute."""
+    onset_env, _ = load_onset(onset_file)
+    start, stop = bounds
+    return _track(onset_env[start:stop], offset=start)
+
+
+def stitch_segments(segments, bounds, overlap=SEGMENT_OVERLAP):
+    """Join per-segment tracking results into one list of beats and a tempo map.
+
+    Each segment keeps the beats of its own half of the overlaps with its
+    neighbours; a beat closer than half a period to the one before it is the
+    same beat seen from both sides of a seam. The tempo map lists
+    ``(time, bpm)`` for every segment, from the first beat it kept, which is
+    what :class:`BeatGrid` expects as tempo changes.
+    """
+    frame_seconds = HOP_LENGTH / ANALYSIS_SR
+    beat_frames, tempo_map = [], []
+    for i, (segment, (start, stop)) in enumerate(zip(segments, bounds)):
+        lo = start + overlap // 2 if i > 0 else start
+        hi = stop - overlap // 2 if i < len(bounds) - 1 else stop
+        min_gap = 30.0 / segment['tempo'] / frame_seconds
+        kept = [
+            f for f in segment['beat_frames']
+            if lo <= f < hi and (not beat_frames or f - beat_frames[-1] > min_gap)
+        ]
+        if kept:
+            tempo_map.append((0.0 if i == 0 else kept[0] * frame_seconds, segment['tempo']))
+            beat_frames.extend(kept)
+    return {
+        'tempo': float(np.median([segment['tempo'] for segment in segments])),
+        'beat_frames': beat_frames,
+        'tempo_map': tempo_map,
+    }
+
+
+def beat_agreement(reference, estimate, tolerance=0.07):
+    """F-measure of ``estimate`` against ``reference`` beat times (seconds).
+
+    A beat matches when it lies within ``tolerance`` seconds of a reference
+    beat, each reference beat matching at most once (the usual MIREX rule).
+    """
+    reference = np.sort(np.asarray(reference, dtype=np.float64))
+    estimate = np.sort(np.asarray(estimate, dtype=np.float64))
+    if len(reference) == 0 or len(estimate) == 0:
+        return float(len(reference) == len(estimate))
+    matched, i = 0, 0
+    for t in estimate:
+        while i < len(reference) and reference[i] < t - tolerance:
+            i += 1
+        if i < len(reference) and abs(reference[i] - t) <= tolerance:
+            matched += 1
+            i += 1
+    precision, recall = matched / len(estimate), matched / len(reference)
+    return 0.0 if matched == 0 else 2 * precision * recall / (precision + recall)
+
+
+def onset_path(audio_file, work_dir=None):
+    return artifact_path(audio_file, ".onset.npz", work_dir)
+
+
+def tempogram_summary(onset_env, block=8192):
+    """Autocorrelation tempogram of ``onset_env``, averaged over ~10 s columns.
+
+    Computed in blocks of ``block`` onset frames (plus one window of context on
+    each side), so the full-resolution tempogram of a long track, hundreds of
+    MB, never exists at once.
+    """
+    columns = []
+    for start in range(0, len(onset_env), block):
+        stop = min(len(onset_env), start + block)
+        lo, hi = max(0, start - TEMPOGRAM_WIN), min(len(onset_env), stop + TEMPOGRAM_WIN)
+        tg = librosa.feature.tempogram(
+            onset_envelope=onset_env[lo:hi], sr=ANALYSIS_SR, hop_length=HOP_LENGTH, win_length=TEMPOGRAM_WIN
+        )[:, start - lo:stop - lo]
+        for col in range(0, tg.shape[1], TEMPOGRAM_STEP):
+            columns.append(tg[:, col:col + TEMPOGRAM_STEP].mean(axis=1))
+    return np.stack(columns, axis=1).astype(np.float32)
+
+
+def tempo_candidates(tempogram, n=5):
+    """The ``n`` strongest tempi of a tempogram, with confidences summing to 1."""
+    bpms = librosa.tempo_frequencies(tempogram.shape[0], hop_length=HOP_LENGTH, sr=ANALYSIS_SR)
+    strength = tempogram.mean(axis=1)
+    usable = (bpms >= TEMPO_RANGE[0]) & (bpms <= TEMPO_RANGE[1])
+    peaks = [
+        i for i in range(1, len(strength) - 1)
+        if usable[i] and strength[i] >= strength[i - 1] and strength[i] > strength[i + 1]
+    ]
+    peaks = sorted(peaks, key=lambda i: strength[i], reverse=True)[:n]
+    total = sum(float(strength[i]) for i in peaks) or 1.0
+    return [
+        {'bpm': round(float(bpms[i]), 2), 'confidence': round(float(strength[i]) / total, 3)}
+        for i in peaks
+    ]
+
+
+@functools.lru_cache(maxsize=8)
+def load_onset(onset_file):
+    with np.load(onset_file) as data:
+        return data['onset_env'], data['tempogram']
+
+
+def retrack(onset_file, grid):
+    """``grid`` with its beats re-tracked on the stored onset envelope.
+
+    Every stretch of constant tempo is tracked on its own at its own bpm,
+    so a segmented analysis keeps its tempo map when it is re-snapped to
+    half, double or a manual tempo. No audio is touched.
+    """
+    onset_env, _ = load_onset(onset_file)
+    frame_seconds = HOP_LENGTH / ANALYSIS_SR
+    phase, changes = grid.phase, []
+    for i, (start, end, bpm, _) in enumerate(grid.segments()):
+        lo, hi = int(start / frame_seconds), min(len(onset_env), int(np.ceil(end / frame_seconds)))
+        beat_times = np.zeros(0)
+        if hi - lo > 1:
+            _, beat_frames = librosa.beat.beat_track(
+                onset_envelope=onset_env[lo:hi], sr=ANALYSIS_SR, hop_length=HOP_LENGTH, bpm=bpm
+            )
+            beat_times = (np.asarray(beat_frames) + lo) * frame_seconds
+        if i == 0:
+            if len(beat_times):
+                phase = BeatGrid.from_beats(beat_times, bpm, grid.duration, fit_tempo=False).phase
+        else:
+            # The grid restarts on a beat at every change, so the change moves to the first one tracked.
+            changes.append((float(beat_times[0]) if len(beat_times) else start, bpm))
+    return BeatGrid(grid.bpm, grid.duration, phase, changes, grid.offset)
+
+
+def warm_up(seconds=10.0, bpm=120.0):
+    """Run the analysis once on a synthetic click track and return how long it took.
+
+    Loads librosa and its numba kernels (compiling them on a cold cache), so
+    the first real request of a process does not pay for it.
+    """
+    started = time.perf_counter()
+    y = np.zeros(int(seconds * ANALYSIS_SR), dtype=np.float32)
+    click = (np.sin(2 * np.pi * 1000 * np.arange(256) / ANALYSIS_SR) * np.linspace(1, 0, 256)).astype(np.float32)
+    for start in range(0, len(y) - len(click), int(60.0 / bpm * ANALYSIS_SR)):
+        y[start:start + len(click)] += click
+    onset_env = onset_envelope_stream([y])
+    _track(onset_env)
+    librosa.beat.beat_track(onset_envelope=onset_env, sr=ANALYSIS_SR, hop_length=HOP_LENGTH, bpm=bpm)
+    tempo_candidates(tempogram_summary(onset_env))
+    return time.perf_counter() - started
@@ -0,0 +1,360 @@
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+ARTIFACT_DIR = os.environ.get(
+    "DESCARGAS_ARTIFACT_DIR", os.path.join(tempfile.gettempdir(), "descargas_youtube")
+)
+ARTIFACT_MAX_BYTES = int(os.environ.get("DESCARGAS_ARTIFACT_MAX_BYTES", 4 * 1024 ** 3))
+SESSION_MAX_BYTES = int(os.environ.get("DESCARGAS_SESSION_MAX_BYTES", 1024 ** 3))
+# Unreferenced artifacts are kept this long in case they are used again.
+ARTIFACT_IDLE_SECONDS = int(os.environ.get("DESCARGAS_ARTIFACT_IDLE_SECONDS", 15 * 60))
+# A session not seen for this long is taken as abandoned and its references dropped.
+SESSION_TTL_SECONDS = int(os.environ.get("DESCARGAS_SESSION_TTL_SECONDS", 2 * 60 * 60))
+JANITOR_INTERVAL = 60
+# Every process keeps its artifacts in a directory of its own under the root,
+# locked for as long as the process lives.
+PROCESS_PREFIX = "proc-"
+LOCK_NAME = ".lock"
+
+
+class QuotaExceeded(Exception):
+    """There is no room for a new artifact; the message is shown to the user."""
+
+
+def path_size(path):
+    """Bytes used by a file, or by every file under a directory."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def _last_modified(path):
+    latest = os.path.getmtime(path)
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                latest = max(latest, os.path.getmtime(os.path.join(dirpath, name)))
+            except OSError:
+                pass
+    return latest
+
+
+def _delete(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def _try_lock(f):
+    """Lock the open file ``f`` for this process without waiting; False if someone else holds it."""
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _owner_alive(path):
+    """Whether the process that made ``path`` still holds its lock."""
+    try:
+        with open(os.path.join(path, LOCK_NAME), "a+b") as f:
+            return not _try_lock(f)
+    except OSError:
+        return True
+
+
+class _Artifact:
+    def __init__(self, path, owner, owned):
+        self.path = path
+        self.owner = owner
+        self.owned = owned
+        self.holders = set()
+        self.size = 0
+        # Bytes promised to ``create_dir`` callers, charged until the files are that big.
+        self.reserved = 0
+        self.last_used = time.time()
+
+    @property
+    def charged(self):
+        return max(self.size, self.reserved)
+
+
+class ArtifactStore:
+    """Tracks the temporary files of every session and keeps them within quotas.
+
+    Artifacts the store creates (downloads in progress, uploads) live in this
+    process's own directory under ``base`` and count against their session's
+    ``session_max_bytes`` and the global ``max_bytes``. Every session using an artifact holds a reference;
+    shared paths owned elsewhere, like analysis cache entries, can be held
+    too, so their owner knows not to remove them.
+
+    An artifact nobody holds is not removed at once: it is evicted least
+    recently used first when a quota needs room, or by :meth:`sweep` once
+    it has been idle for ``idle_seconds``. The sweep also drops the
+    references of sessions not seen for ``session_ttl`` and removes the
+    directories of processes that are gone (never those of another live
+    server or CLI run sharing ``base``); :meth:`start_janitor` runs it
+    periodically.
+    """
+
+    def __init__(self, base=ARTIFACT_DIR, max_bytes=ARTIFACT_MAX_BYTES, session_max_bytes=SESSION_MAX_BYTES,
+                 idle_seconds=ARTIFACT_IDLE_SECONDS, session_ttl=SESSION_TTL_SECONDS):
+        self.base = base
+        self.max_bytes = max_bytes
+        self.session_max_bytes = session_max_bytes
+        self.idle_seconds = idle_seconds
+        self.session_ttl = session_ttl
+        self.bytes_reclaimed = 0
+        self.evictions = 0
+        self._artifacts = {}
+        self._sessions = {}
+        self._lock = threading.Lock()
+        # Held from the quota check until the new artifact and its reservation are tracked.
+        self._room_lock = threading.Lock()
+        self._janitor = None
+        self._root = None
+        self._root_lock = None
+        self._root_pid = None
+
+    @property
+    def root(self):
+        """This process's directory, made and locked on first use.
+
+        Worker processes import the store too, but only those that create
+        artifacts get a directory.
+        """
+        with self._lock:
+            if self._root is None or self._root_pid != os.getpid():
+                os.makedirs(self.base, exist_ok=True)
+                root = tempfile.mkdtemp(prefix=f"{PROCESS_PREFIX}{os.getpid()}-", dir=self.base)
+                self._root_lock = open(os.path.join(root, LOCK_NAME), "a+b")
+                _try_lock(self._root_lock)
+                self._root, self._root_pid = root, os.getpid()
+                atexit.register(self._remove_root, root, self._root_lock)
+            return self._root
+
+    @staticmethod
+    def _remove_root(root, lock):
+        lock.close()
+        shutil.rmtree(root, ignore_errors=True)
+
+    def touch(self, session_id):
+        """Mark ``session_id`` as active, so the sweep keeps its references."""
+        self._sessions[session_id] = time.time()
+
+    def create_dir(self, session_id, prefix="tmp", expected_bytes=0):
+        """A new empty directory owned and held by ``session_id``.
+
+        Raises :class:`QuotaExceeded` when ``expected_bytes`` more would not
+        fit in the session's or the global quota, even after evicting
+        unreferenced artifacts.
+        """
+        root = self.root
+        # Two callers checking the same free space must not both be told it fits.
+        with self._room_lock:
+            self._make_room(session_id, expected_bytes)
+            path = tempfile.mkdtemp(prefix=f"{prefix}-", dir=root)
+            with self._lock:
+                artifact = self._artifacts[path] = _Artifact(path, session_id, owned=True)
+                artifact.reserved = expected_bytes
+                artifact.holders.add(session_id)
+        self.touch(session_id)
+        return path
+
+    def hold(self, session_id, path):
+        """Take a reference on ``path``; paths the store did not create are never removed by it."""
+        with self._lock:
+            artifact = self._artifacts.get(path)
+            if artifact is None:
+                artifact = self._artifacts[path] = _Artifact(path, session_id, owned=False)
+            artifact.holders.add(session_id)
+            artifact.last_used = time.time()
+        self.touch(session_id)
+
+    def is_held(self, path):
+        with self._lock:
+            artifact = self._artifacts.get(path)
+            return bool(artifact and artifact.holders)
+
+    def release(self, session_id, path):
+        """Drop ``session_id``'s reference on ``path``; the artifact becomes evictable once nobody holds it."""
+        with self._lock:
+            artifact = self._artifacts.get(path)
+            if artifact is None:
+                return
+            artifact.holders.discard(session_id)
+            artifact.last_used = time.time()
+            if not artifact.holders and not artifact.owned:
+                del self._artifacts[path]
+
+    def release_session(self, session_id):
+        """Drop every reference ``session_id`` holds."""
+        with self._lock:
+            paths = [path for path, artifact in self._artifacts.items() if session_id in artifact.holders]
+        for path in paths:
+            self.release(session_id, path)
+        self._sessions.pop(session_id, None)
+
+    def remove(self, path):
+        """Delete a scratch artifact right away, whoever holds it."""
+        with self._lock:
+            artifact = self._artifacts.pop(path, None)
+        if artifact is not None and artifact.owned:
+            self._reclaim([artifact])
+
+    def _refresh(self, artifacts):
+        for artifact in artifacts:
+            artifact.size = path_size(artifact.path) if os.path.exists(artifact.path) else 0
+
+    def _owned(self, session_id=None):
+        with self._lock:
+            return [
+                artifact for artifact in self._artifacts.values()
+                if artifact.owned and (session_id is None or artifact.owner == session_id)
+            ]
+
+    def _evict(self, candidates, excess):
+        """Remove unreferenced ``candidates``, least recently used first, until ``excess`` bytes are freed."""
+        with self._lock:
+            idle = sorted(
+                (a for a in candidates if not a.holders and self._artifacts.get(a.path) is a),
+                key=lambda a: a.last_used,
+            )
+            victims = []
+            for artifact in idle:
+                if excess <= 0:
+                    break
+                del self._artifacts[artifact.path]
+                victims.append(artifact)
+                excess -= artifact.charged
+        self.evictions += len(victims)
+        self._reclaim(victims)
+        return excess
+
+    def _make_room(self, session_id, expected_bytes):
+        session = self._owned(session_id)
+        self._refresh(session)
+        excess = sum(a.charged for a in session) + expected_bytes - self.session_max_bytes
+        if excess > 0 and self._evict(session, excess) > 0:
+            raise QuotaExceeded(
+                f"Esta sesión ya usa {self.session_max_bytes // 1024 ** 2} MB de archivos temporales; "
+                "pulsa «Limpiar» para liberar espacio."
+            )
+        everything = self._owned()
+        self._refresh(everything)
+        excess = sum(a.charged for a in everything) + expected_bytes - self.max_bytes
+        if excess > 0 and self._evict(everything, excess) > 0:
+            raise QuotaExceeded("El servidor no tiene espacio temporal libre ahora mismo; inténtalo más tarde.")
+
+    def _reclaim(self, artifacts):
+        for artifact in artifacts:
+            size = path_size(artifact.path) if os.path.exists(artifact.path) else 0
+            _delete(artifact.path)
+            self.bytes_reclaimed += size
+
+    def _leftovers(self, known, now):
+        """Paths under ``base`` that no live process owns."""
+        root = self._root if self._root_pid == os.getpid() else None
+        leftovers = []
+        for name in os.listdir(self.base):
+            path = os.path.join(self.base, name)
+            try:
+                if path == root:
+                    # Files in our own directory nobody tracks were dropped mid-write.
+                    leftovers += [
+                        os.path.join(path, child) for child in os.listdir(path)
+                        if child != LOCK_NAME and os.path.join(path, child) not in known
+                        and now - _last_modified(os.path.join(path, child)) > self.idle_seconds
+                    ]
+                elif name.startswith(PROCESS_PREFIX) and os.path.isdir(path):
+                    # Until its lock exists, a new directory is given the benefit of the doubt.
+                    locked = os.path.exists(os.path.join(path, LOCK_NAME))
+                    if (locked or now - _last_modified(path) > self.idle_seconds) and not _owner_alive(path):
+                        leftovers.append(path)
+                elif now - _last_modified(path) > self.idle_seconds:
+                    # Left by a version that kept everything straight under the root.
+                    leftovers.append(path)
+            except OSError:
+                pass
+        return leftovers
+
+    def sweep(self):
+        """Expire abandoned sessions and idle artifacts, remove leftovers and enforce ``max_bytes``."""
+        now = time.time()
+        for session_id, seen in list(self._sessions.items()):
+            if now - seen > self.session_ttl:
+                self.release_session(session_id)
+        with self._lock:
+            expired = [
+                artifact for artifact in self._artifacts.values()
+                if artifact.owned and not artifact.holders and now - artifact.last_used > self.idle_seconds
+            ]
+            for artifact in expired:
+                del self._artifacts[artifact.path]
+            known = set(self._artifacts)
+        if os.path.isdir(self.base):
+            expired += [_Artifact(path, None, owned=True) for path in self._leftovers(known, now)]
+        reclaimed = self.bytes_reclaimed
+        self._reclaim(expired)
+        everything = self._owned()
+        self._refresh(everything)
+        excess = sum(a.charged for a in everything) - self.max_bytes
+        if excess > 0:
+            self._evict(everything, excess)
+        if self.bytes_reclaimed > reclaimed:
+            print(f"[artefactos] Liberados {(self.bytes_reclaimed - reclaimed) / 1024 ** 2:.1f} MB; "
+                  f"en uso {self.stats()['bytes_held'] / 1024 ** 2:.1f} MB")
+
+    def stats(self):
+        artifacts = self._owned()
+        return {
+            "artifacts": len(artifacts),
+            "bytes_held": sum(a.size for a in artifacts),
+            "bytes_reclaimed": self.bytes_reclaimed,
+            "evictions": self.evictions,
+            "sessions": len(self._sessions),
+        }
+
+    def start_janitor(self, interval=JANITOR_INTERVAL):
+        """Run :meth:`sweep` now and then every ``interval`` seconds, on a daemon thread."""
+        if self._janitor is not None:
+            return
+
+        def run():
+            # The first sweep also clears what a previous run left behind.
+            while True:
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"Error en la limpieza de temporales: {e}")
+                time.sleep(interval)
+
+        self._janitor = threading.Thread(target=run, name="descargas-janitor", daemon=True)
+        self._janitor.start()
+
+
+artifact_store = ArtifactStore()
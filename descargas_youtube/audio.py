@@ -0,0 +1,143 @@
+import os
+import re
+import shutil
+import subprocess
+import threading
+
+import numpy as np
+
+from .metrics import Span
+
+FFMPEG = shutil.which("ffmpeg") or "ffmpeg"
+
+# Output arguments for each export format, keyed by file extension.
+EXPORT_FORMATS = {
+    "wav": ["-c:a", "pcm_s16le", "-f", "wav"],
+    "flac": ["-c:a", "flac", "-f", "flac"],
+    "mp3": ["-c:a", "libmp3lame", "-b:a", "192k", "-f", "mp3"],
+    "opus": ["-c:a", "libopus", "-b:a", "160k", "-ar", "48000", "-f", "ogg"],
+}
+
+
+def _run_ffmpeg(args, path):
+    proc = subprocess.run(
+        [FFMPEG, "-v", "error", "-nostdin", *args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    if proc.returncode != 0:
+        message = proc.stderr.decode(errors="replace").strip()
+        raise Exception(f"ffmpeg no pudo procesar {os.path.basename(path)}: {message}")
+    return proc.stdout
+
+
+def probe_duration(path):
+    """Length of ``path`` in seconds as its header states it, or None when it has none.
+
+    ``ffmpeg -i`` without an output only reads the header, and prints the
+    length on stderr.
+    """
+    proc = subprocess.run([FFMPEG, "-nostdin", "-i", path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    match = re.search(rb"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", proc.stderr)
+    if match is None:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def encode_mp3(path, output_file, bitrate="192k"):
+    with Span("mp3") as span:
+        _run_ffmpeg(["-y", "-i", path, "-vn", "-codec:a", "libmp3lame", "-b:a", bitrate, output_file], path)
+        span.bytes = os.path.getsize(output_file)
+    return output_file
+
+
+def cut_section(path, section, dest_dir):
+    """Decode seconds ``(start, end)`` of ``path`` into a WAV in ``dest_dir``.
+
+    The seek happens on the input, so only the packets of the section are
+    read. A stream copy would start at the packet boundary before ``start``,
+    putting every beat off by up to a packet; decoding starts on the exact
+    sample. ``end`` may be ``None`` for "to the end of the file".
+    """
+    start, end = section
+    base = os.path.splitext(os.path.basename(path))[0]
+    output_file = os.path.join(dest_dir, f"{base}_{start:g}-{'' if end is None else f'{end:g}'}.wav")
+    args = ["-ss", str(start)]
+    if end is not None:
+        args += ["-t", str(end - start)]
+    with Span("cut", track_seconds=None if end is None else end - start) as span:
+        _run_ffmpeg(["-y", *args, "-i", path, "-vn", "-c:a", "pcm_s16le", output_file], path)
+        span.bytes = os.path.getsize(output_file)
+    return output_file
+
+
+def mp3_version(path):
+    """Return an MP3 of ``path``, encoding it next to the source on first use."""
+    if path.lower().endswith(".mp3"):
+        return path
+    output_file = os.path.splitext(path)[0] + ".mp3"
+    if not os.path.exists(output_file):
+        # Per process and thread, so concurrent encoders of one source never share it.
+        partial = f"{output_file}.{os.getpid()}-{threading.get_ident()}.part.mp3"
+        encode_mp3(path, partial)
+        os.replace(partial, output_file)
+    return output_file
+
+
+class StreamEncoder:
+    """An ffmpeg process that encodes int16 PCM written to it into several files.
+
+    One input feeds every requested format, so a render is mixed once no
+    matter how many exports it produces, and encoding runs in parallel with
+    the mixing that feeds it.
+    """
+
+    def __init__(self, outputs, sr, channels):
+        self.outputs = outputs
+        args = ["-f", "s16le", "-ar", str(sr), "-ac", str(channels), "-i", "-"]
+        for fmt, output_file in outputs.items():
+            args += [*EXPORT_FORMATS[fmt], "-y", output_file]
+        self.proc = subprocess.Popen(
+            [FFMPEG, "-v", "error", "-nostdin", *args],
+            stdin=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+    def write(self, pcm):
+        self.proc.stdin.write(np.ascontiguousarray(pcm, dtype=np.int16).tobytes())
+
+    def close(self):
+        self.proc.stdin.close()
+        message = self.proc.stderr.read().decode(errors="replace").strip()
+        if self.proc.wait() != 0:
+            raise Exception(f"ffmpeg no pudo exportar el audio: {message}")
+        return self.outputs
+
+    def abort(self):
+        self.proc.kill()
+        self.proc.wait()
+        for output_file in self.outputs.values():
+            if os.path.exists(output_file):
+                os.unlink(output_file)
+
+
+def export_stream(chunks, outputs, sr, channels):
+    """Encode an iterable of int16 PCM chunks into every file in ``outputs``."""
+    # Time spent handing chunks to ffmpeg, i.e. waiting on the encoder.
+    encoding = Span("export", repeat=True)
+    encoder = StreamEncoder(outputs, sr, channels)
+    try:
+        for chunk in chunks:
+            with encoding:
+                encoder.write(chunk)
+                encoding.bytes += chunk.nbytes
+        with encoding:
+            result = encoder.close()
+    except BaseException:
+        encoder.abort()
+        raise
+    finally:
+        encoding.track_seconds = encoding.bytes / (sr * channels * 2)
+        encoding.record()
+    return result
@@ -0,0 +1,106 @@
+import math
+
+import numpy as np
+
+
+class BeatGrid:
+    """A beat grid described by its tempo instead of a list of beat times.
+
+    ``bpm`` and ``phase`` (time of the first beat, in seconds, within one beat
+    period) define a uniform grid over ``duration`` seconds. ``changes`` is an
+    optional sorted list of ``(time, bpm)`` points where the tempo changes;
+    the grid restarts with a beat at each of them. Beat positions are only
+    produced on request, for the window the caller needs.
+
+    Times are relative to the analyzed audio. When that is a section of a
+    longer track, ``offset`` is where the section starts on the original
+    timeline, kept so results can be placed back on it.
+    """
+
+    def __init__(self, bpm, duration, phase=0.0, changes=(), offset=0.0):
+        self.bpm = float(bpm)
+        self.duration = float(duration)
+        self.phase = float(phase) % (60.0 / self.bpm) if self.bpm > 0 else 0.0
+        self.changes = [(float(t), float(b)) for t, b in changes]
+        self.offset = float(offset)
+
+    @classmethod
+    def from_beats(cls, beat_times, bpm, duration, changes=(), offset=0.0, fit_tempo=True):
+        """Fit a grid to tracked beat positions.
+
+        ``bpm`` and the bpm of every tempo change are estimates: each stretch
+        of constant tempo takes the period and first beat of a least-squares
+        line through its beats (see :func:`fit_beats`), and every change moves
+        onto the first beat of its stretch. With ``fit_tempo`` false the tempi
+        are kept as given and only the beat positions are fitted.
+        """
+        beat_times = np.asarray(beat_times, dtype=np.float64)
+        starts = [(0.0, bpm)] + [(float(t), float(b)) for t, b in changes]
+        # A change sits on a tracked beat; that beat opens the stretch after it.
+        bounds = np.searchsorted(beat_times, [t - 1e-6 for t, _ in starts[1:]])
+        stretches = np.split(beat_times, bounds)
+        fitted = []
+        for (start, estimate), beats in zip(starts, stretches):
+            period, first = fit_beats(beats, 60.0 / estimate, fit_tempo)
+            fitted.append((start if first is None else first, 60.0 / period))
+        phase = fitted[0][0] if len(stretches[0]) else 0.0
+        return cls(fitted[0][1], duration, phase, fitted[1:], offset)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["bpm"], data["duration"], data.get("phase", 0.0), data.get("changes", ()), data.get("offset", 0.0)
+        )
+
+    def to_dict(self):
+        return {
+            "bpm": self.bpm, "duration": self.duration, "phase": self.phase,
+            "changes": self.changes, "offset": self.offset,
+        }
+
+    def scaled(self, factor):
+        """The same grid at ``factor`` times the tempo (0.5 = half, 2 = double)."""
+        changes = [(t, b * factor) for t, b in self.changes]
+        return BeatGrid(self.bpm * factor, self.duration, self.phase, changes, self.offset)
+
+    def segments(self):
+        """``(start, end, bpm, phase)`` of every stretch of constant tempo."""
+        starts = [(0.0, self.bpm, self.phase)] + [(t, b, 0.0) for t, b in self.changes]
+        for i, (start, bpm, phase) in enumerate(starts):
+            end = starts[i + 1][0] if i + 1 < len(starts) else self.duration
+            yield start, end, bpm, phase
+
+    def times(self, start=0.0, end=None):
+        """Beat positions in seconds within ``[start, end)`` as a float64 array."""
+        end = self.duration if end is None else min(end, self.duration)
+        parts = []
+        for seg_start, seg_end, bpm, phase in self.segments():
+            lo, hi = max(start, seg_start), min(end, seg_end)
+            if lo >= hi or bpm <= 0:
+                continue
+            period = 60.0 / bpm
+            origin = seg_start + phase
+            first = math.ceil((lo - origin) / period)
+            last = math.ceil((hi - origin) / period)
+            parts.append(origin + np.arange(max(first, 0), max(last, 0)) * period)
+        return np.concatenate(parts) if parts else np.zeros(0)
+
+
+def fit_beats(beat_times, period, fit_period=True):
+    """``(period, first)`` of the least-squares line through ``beat_times``.
+
+    Beats are numbered by rounding the gaps between them to multiples of
+    the estimated ``period``, so a missed beat does not bend the line. The
+    period is kept as given without ``fit_period`` or with fewer than two
+    beats; ``first`` is None without any.
+    """
+    beat_times = np.asarray(beat_times, dtype=np.float64)
+    if len(beat_times) == 0:
+        return period, None
+    steps = np.maximum(1, np.round(np.diff(beat_times) / period))
+    index = np.concatenate([[0], np.cumsum(steps)])
+    if fit_period and len(beat_times) > 1:
+        period, first = np.polyfit(index, beat_times, 1)
+    else:
+        first = np.mean(beat_times - index * period)
+    return float(period), float(first)
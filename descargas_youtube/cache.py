@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+from .artifacts import artifact_store, path_size
+
+CACHE_DIR = os.environ.get(
+    "DESCARGAS_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "descargas_youtube"),
+)
+CACHE_MAX_BYTES = int(os.environ.get("DESCARGAS_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _section_suffix(section):
+    if section is None:
+        return ""
+    start, end = section
+    return f"_{start:g}-{'' if end is None else f'{end:g}'}"
+
+
+def video_key(video_id, section=None):
+    return f"yt-{video_id}{_section_suffix(section)}"
+
+
+def upload_key(digest, section=None):
+    return f"sha256-{digest}{_section_suffix(section)}"
+
+
+class AnalysisCache:
+    """On-disk cache of analysis results with size-bounded LRU eviction.
+
+    Each entry is a directory holding ``meta.json`` next to the audio files the
+    analysis was computed from. The mtime of ``meta.json`` is bumped on every
+    hit and is the LRU clock, so recency survives restarts and is shared by
+    every worker process pointing at the same directory.
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, re.sub(r"[^A-Za-z0-9_.-]", "_", key))
+
+    def get(self, key):
+        """Return the cached metadata for ``key`` or ``None`` on a miss."""
+        meta_path = os.path.join(self.entry_dir(key), "meta.json")
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = None
+        files = (meta or {}).get("files")
+        if not files or not all(os.path.exists(path) for path in files.values()):
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return meta
+
+    def put(self, key, files, move=False, **result):
+        """Store ``result`` and a copy of each path in ``files`` under ``key``.
+
+        ``files`` maps a field name to a path; the returned metadata has the
+        same fields pointing at the cached copies. ``move`` is either a bool
+        or the set of fields whose files are moved instead of copied. The entry is assembled in a
+        scratch directory and renamed into place, so concurrent readers never
+        see a half-written entry.
+        """
+        entry = self.entry_dir(key)
+        scratch = f"{entry}.tmp-{os.getpid()}-{threading.get_ident()}"
+        os.makedirs(scratch, exist_ok=True)
+        cached_files = {}
+        for field, path in files.items():
+            name = os.path.basename(path)
+            if move is True or (move and field in move):
+                shutil.move(path, os.path.join(scratch, name))
+            else:
+                shutil.copy2(path, os.path.join(scratch, name))
+            cached_files[field] = os.path.join(entry, name)
+        meta = dict(result, key=key, files=cached_files, created=time.time(), **cached_files)
+        with open(os.path.join(scratch, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        shutil.rmtree(entry, ignore_errors=True)
+        try:
+            os.replace(scratch, entry)
+        except OSError:
+            # Another worker stored the same key first; keep its entry.
+            shutil.rmtree(scratch, ignore_errors=True)
+        self.evict()
+        return meta
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits ``max_bytes``.
+
+        Entries a session holds in the artifact store (the track it has open)
+        are skipped.
+        """
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            meta_path = os.path.join(path, "meta.json")
+            if ".tmp-" in name or not os.path.exists(meta_path):
+                continue
+            entries.append((os.path.getmtime(meta_path), path_size(path), path))
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        # The most recent entry is never evicted, even if it alone exceeds the limit.
+        for _, size, path in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            if artifact_store.is_held(path):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+analysis_cache = AnalysisCache()
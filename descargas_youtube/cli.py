@@ -0,0 +1,142 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import tempfile
+
+from .engine import analyze, beat_grid, render, summary
+from .fetch import AudioFetcher, export_name
+from .jobs import scheduler
+from .metrics import job
+
+AUDIO_EXTENSIONS = {".mp3", ".wav", ".flac", ".aac", ".ogg", ".m4a", ".opus", ".webm"}
+CSV_FIELDS = ["source", "title", "bpm", "half_bpm", "double_bpm", "duration", "phase", "offset", "tempo_changes", "error"]
+
+
+def expand_inputs(inputs, fetcher):
+    """Turn directories, URL list files, playlists and single items into items to analyze.
+
+    URLs are expanded with ``fetcher``, which then resolves single videos without extracting them again.
+    """
+    items = []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for root, _, names in os.walk(entry):
+                items += sorted(
+                    os.path.join(root, name) for name in names
+                    if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS
+                )
+        elif os.path.isfile(entry) and entry.lower().endswith(".txt"):
+            with open(entry, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith("#"):
+                        items += fetcher.expand(line)
+        elif os.path.isfile(entry):
+            items.append(entry)
+        else:
+            items += fetcher.expand(entry)
+    # Keep the first occurrence of every item, in order.
+    return list(dict.fromkeys(items))
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            return list(csv.DictReader(f))
+        return json.load(f)
+
+
+def save_results(path, rows):
+    """Rewrite the results file atomically, so an interrupted run leaves a valid one."""
+    partial = f"{path}.part"
+    with open(partial, "w", encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            for row in rows:
+                grid = row.get("grid") or {}
+                writer.writerow({
+                    **row,
+                    "phase": row.get("phase", grid.get("phase")),
+                    "offset": row.get("offset", grid.get("offset")),
+                    "tempo_changes": row.get("tempo_changes") or json.dumps(grid.get("changes", [])),
+                })
+        else:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+    os.replace(partial, path)
+
+
+async def process(items, args, done, fetcher):
+    """Analyze (and optionally render) every item; ``done(row)`` is called as each finishes.
+
+    Every URL is fetched through ``fetcher``'s yt-dlp session; each download
+    lands in a directory its analysis reserves and then moves into the cache.
+    """
+    section = (args.start, args.end) if args.start or args.end else None
+    limit = asyncio.Semaphore(args.parallel)
+
+    async def one(index, item):
+        # One scheduler session per item, so the per-session limit does not serialize them.
+        session_id = f"cli-{index}"
+        async with limit:
+            try:
+                with job("cli", session_id, args.profile):
+                    title, result = await analyze(item, session_id, section, fetcher=fetcher)
+                    row = {"source": item, "title": title, **summary(result)}
+                    if args.render:
+                        outputs = {
+                            fmt: os.path.join(args.render, export_name(f"{title}_with_metronome", fmt))
+                            for fmt in args.formats
+                        }
+                        await render(session_id, result['audio_file'], beat_grid(result), args.volume, outputs)
+                        row["rendered"] = list(outputs.values())
+            except Exception as e:
+                row = {"source": item, "error": str(e)}
+        done(row)
+
+    await asyncio.gather(*(one(i, item) for i, item in enumerate(items)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m descargas_youtube",
+        description="Analiza el tempo de archivos, listas de URLs o listas de reproducción.",
+    )
+    parser.add_argument("inputs", nargs="+", help="directorio, archivo de audio, archivo .txt con URLs, URL o playlist")
+    parser.add_argument("-o", "--output", default="resultados.json", help="archivo de resultados (.json o .csv)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="procesos de análisis (por defecto, uno por núcleo)")
+    parser.add_argument("-p", "--parallel", type=int, default=8, help="elementos en curso a la vez")
+    parser.add_argument("--start", type=float, default=0, help="inicio de la sección a analizar, en segundos")
+    parser.add_argument("--end", type=float, default=None, help="fin de la sección a analizar, en segundos")
+    parser.add_argument("--render", metavar="DIR", help="exportar también cada pista con metrónomo a DIR")
+    parser.add_argument("--formats", default="mp3", type=lambda v: v.split(","), help="formatos de exportación, p. ej. mp3,wav")
+    parser.add_argument("--volume", type=float, default=-20, help="volumen del metrónomo en dB")
+    parser.add_argument("--profile", metavar="DIR", help="guardar un perfil de cProfile de cada etapa en DIR")
+    args = parser.parse_args(argv)
+
+    if args.jobs:
+        scheduler.limits["cpu"] = args.jobs
+    if args.render:
+        os.makedirs(args.render, exist_ok=True)
+
+    rows = load_results(args.output)
+    finished = {row["source"] for row in rows if not row.get("error")}
+    # Failed items are tried again; their old rows are replaced.
+    rows = [row for row in rows if row["source"] in finished]
+
+    def done(row):
+        rows.append(row)
+        save_results(args.output, rows)
+        if row.get("error"):
+            print(f"[{len(rows)}] ERROR {row['source']}: {row['error']}")
+        else:
+            print(f"[{len(rows)}] {row['bpm']} BPM  {row['title']}")
+
+    with AudioFetcher(tempfile.gettempdir()) as fetcher:
+        items = [item for item in expand_inputs(args.inputs, fetcher) if item not in finished]
+        print(f"{len(items)} elementos por procesar ({len(finished)} ya en {args.output}).")
+        asyncio.run(process(items, args, done, fetcher))
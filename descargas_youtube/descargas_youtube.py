@@ -1,17 +1,50 @@
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
 import reflex as rx
-import yt_dlp
+import json
 import os
-import librosa
-import numpy as np
 import tempfile
-import pygame
 import shutil
-import glob
 import threading
 import asyncio
-from pydub import AudioSegment
-from pydub.generators import Sine
-import re
+
+from .analysis import retrack, warm_up
+from .artifacts import artifact_store
+from .audio import mp3_version
+from .beatgrid import BeatGrid
+from .cache import analysis_cache, file_hash, upload_key, video_key
+from .engine import beat_grid, render, shared_analysis
+from .fetch import AudioFetcher, cancel_hook, export_name
+from .jobs import BATCH_DOWNLOADS, WARM_UP, JobCancelled, check, scheduler
+from .lazy import lazy_import
+from .metrics import METRICS_PORT, registry, serve
+from .pcm import PCM_SR, ensure_pcm, open_pcm
+from .playback import close_player, get_player, open_player
+from .progress import ProgressBridge, describe_download
+from .render import render_preview
+from .uploads import UPLOAD_ROUTE, issue_ticket, receive_upload, take_upload
+from .waveform import waveform_view
+
+yt_dlp = lazy_import("yt_dlp")
+pygame = lazy_import("pygame")
+
+UPLOAD_INPUT_ID = "audio_upload"
+# Posts the picked file's body straight to the backend's streaming route and
+# hands the ticket back, whatever happened; the server knows the outcome.
+UPLOAD_SCRIPT = """
+(async () => {{
+  const file = document.getElementById("{input_id}").files[0];
+  if (file) {{
+    try {{
+      await fetch("{url}&name=" + encodeURIComponent(file.name), {{method: "POST", body: file}});
+    }} catch (e) {{}}
+  }}
+  return "{ticket}";
+}})()
+"""
+
 
 class State(rx.State):
     url: str = ""
@@ -23,18 +56,132 @@ class State(rx.State):
     bpm: float = 0
     half_bpm: float = 0
     double_bpm: float = 0
-    beat_times: list = []
+    _base_grid: dict = {}
+    # The base grid's reported tempo unrounded; ``bpm`` is rounded for display.
+    _tempo: float = 0.0
+    _beat_grid: dict = {}
+    _onset_file: str = ""
+    _peaks_file: str = ""
+    waveform: list[dict] = []
+    waveform_start: float = 0
+    waveform_end: float = 0
+    tempo_candidates: list[dict] = []
     is_playing: bool = False
+    playback_position: float = 0
     audio_duration: float = 0
-    temp_dir: str = ""
     manual_bpm: float = 0
     metronome_volume: float = -20
     download_progress: int = 0
-    temp_files: list = []
+    download_stats: str = ""
     progress_value: int = 0
     is_processing: bool = False
     tempo_option: str = "normal"
     uploaded_audio: str = ""
+    export_formats: list[str] = ["mp3"]
+    preview_start: float = 0
+    section_start: str = ""
+    section_end: str = ""
+    section_offset: float = 0
+    _upload_hash: str = ""
+    _upload_dir: str = ""
+    _analysis_dir: str = ""
+    cache_hits: int = 0
+    cache_misses: int = 0
+    batch_items: list[dict] = []
+    batch_limit: int = min(3, BATCH_DOWNLOADS)
+    _batch_files: list = []
+
+    def _apply_analysis(self, result):
+        """Copy a (possibly cached) analysis result into the state."""
+        tempo = result['tempo']
+        self.audio_file = result['audio_file']
+        self.audio_duration = result['duration']
+        self._tempo = tempo
+        self.bpm = round(tempo, 2)
+        self.half_bpm = round(tempo / 2, 2)
+        self.double_bpm = round(tempo * 2, 2)
+        section = result.get('section')
+        self.section_offset = section[0] if section else 0
+        # Held so the cache does not evict the track this session has open.
+        session_id = self.router.session.client_token
+        entry = analysis_cache.entry_dir(result['key'])
+        if entry != self._analysis_dir:
+            artifact_store.hold(session_id, entry)
+            if self._analysis_dir:
+                artifact_store.release(session_id, self._analysis_dir)
+            self._analysis_dir = entry
+        self._base_grid = beat_grid(result).to_dict()
+        self._onset_file = result.get('onset_file', '')
+        # Entries cached before waveforms existed have no peaks; they just show none.
+        self._peaks_file = result.get('peaks_file', '')
+        self.waveform_start, self.waveform_end = 0, self.audio_duration
+        self.tempo_candidates = [
+            {'bpm': c['bpm'], 'confidence': int(round(c['confidence'] * 100))}
+            for c in result.get('tempo_candidates', [])
+        ]
+        self.cache_hits = analysis_cache.hits
+        self.cache_misses = analysis_cache.misses
+        # Scaled only for now; the caller re-tracks it with ``_update_beat_grid``.
+        self._set_beat_grid(BeatGrid.from_dict(self._base_grid).scaled(self._tempo_factor()))
+        self.progress_value = 100
+        self.status = f"Análisis completado. BPM: {self.bpm} (Lento: {self.half_bpm}, Rápido: {self.double_bpm})"
+        if section:
+            end = section[1] if section[1] is not None else self.section_offset + self.audio_duration
+            self.status += f" · Sección {self.section_offset:g}–{end:g} s"
+
+    def _queue_status(self, label):
+        """An ``on_position`` callback showing the queue position, then ``label`` once running."""
+        async def on_position(position):
+            async with self:
+                self.status = f"En cola (posición {position})..." if position else label
+
+        return on_position
+
+    async def _run_job(self, label, fn, *args, kind="cpu", token=None):
+        """Run a blocking stage on the shared scheduler, showing the queue position."""
+        return await scheduler.run(
+            self.router.session.client_token, fn, *args, kind=kind, on_position=self._queue_status(label),
+            token=token,
+        )
+
+    def _start_job(self, name, supersedes=()):
+        """Cancel token for a new job of this session; an older ``name`` job is cancelled."""
+        artifact_store.touch(self.router.session.client_token)
+        return scheduler.start_job(self.router.session.client_token, name, supersedes)
+
+    async def _finish_job(self, name, token):
+        """Clear the busy flag and download bar unless the job was cancelled (its replacement owns them now)."""
+        scheduler.finish_job(self.router.session.client_token, name, token)
+        if not token.cancelled:
+            async with self:
+                self.is_processing = False
+                self.download_progress = 0
+                self.download_stats = ""
+
+    async def _shared_analysis(self, cache_key, source, section, token):
+        """Analyze ``source``, or attach to the session already analyzing ``cache_key``."""
+        return await shared_analysis(
+            self.router.session.client_token, source, section, cache_key, self._publish_progress, token
+        )
+
+    def _section(self, duration=None):
+        """The ``(start, end)`` seconds to analyze, or None for the whole track.
+
+        Both ends accept seconds or ``mm:ss``; an empty end means the end of
+        the track, which ``duration`` fills in when it is known.
+        """
+        start_text, end_text = self.section_start.strip(), self.section_end.strip()
+        start = yt_dlp.utils.parse_duration(start_text) if start_text else 0.0
+        end = yt_dlp.utils.parse_duration(end_text) if end_text else None
+        if start is None or (end_text and end is None):
+            raise Exception("Formato de tiempo no válido; usa segundos o mm:ss.")
+        if duration and (end is None or end > duration):
+            end = duration
+        if end is not None and end <= start:
+            raise Exception("El final de la sección debe ser posterior al inicio.")
+        if start <= 0 and (end is None or end == duration):
+            return None
+        return (float(start), None if end is None else float(end))
 
     @rx.background
     async def get_info_and_analyze(self):
@@ -42,18 +189,27 @@ class State(rx.State):
             async with self:
                 self.status = "Por favor, ingresa una URL válida o sube un archivo de audio."
             return
-            
+        if len(self.url.split()) > 1:
+            async with self:
+                self.status = "Hay varias URLs; usa «Analizar lista» para procesarlas en lote."
+            return
+
+        # A new analysis replaces the track every other job works on.
+        token = self._start_job("analysis", supersedes=("download", "clean_audio", "render", "tempo"))
         try:
             async with self:
                 self.is_processing = True
                 self.progress_value = 0
                 self.status = "Obteniendo información del audio..."
-            
+
             if self.url:
-                ydl_opts = {'quiet': True}
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(self.url, download=False)
-                
+                # This fetcher only resolves; the shared job downloads with its own.
+                with AudioFetcher(tempfile.gettempdir(), token=token) as fetcher:
+                    info = await self._run_job(
+                        "Obteniendo información del audio...", fetcher.resolve, self.url.strip(),
+                        kind="io", token=token,
+                    )
+
                 async with self:
                     self.video_info = {
                         'title': info['title'],
@@ -63,81 +219,59 @@ class State(rx.State):
                     self.status = "Información del video obtenida. Comenzando análisis de audio..."
                     self.progress_value = 25
 
-                temp_dir = tempfile.mkdtemp()
-                audio_file = os.path.join(temp_dir, 'audio.mp3')
-
-                def progress_hook(d):
-                    asyncio.create_task(self.download_progress_hook(d))
-
-                ydl_opts = {
-                    'format': 'bestaudio/best',
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '192',
-                    }],
-                    'outtmpl': audio_file,
-                    'progress_hooks': [progress_hook],
-                    'keepvideo': False,
-                }
-
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ydl.download([self.url])
-
-                if not os.path.exists(audio_file):
-                    original_file = audio_file.rsplit('.', 1)[0] + '.*'
-                    original_files = glob.glob(original_file)
-                    if original_files:
-                        os.rename(original_files[0], audio_file)
-                    else:
-                        raise Exception(f"No se encontró ningún archivo de audio en: {temp_dir}")
+                section = self._section(info.get('duration'))
+                cache_key, source = video_key(info['id'], section), info
             else:
-                audio_file = self.uploaded_audio
-                temp_dir = os.path.dirname(audio_file)
+                section = self._section()
+                digest = self._upload_hash or await self._run_job(
+                    "Calculando huella del archivo...", file_hash, self.uploaded_audio, kind="io", token=token
+                )
+                cache_key, source = upload_key(digest, section), self.uploaded_audio
 
-            async with self:
-                self.status = "Analizando el audio..."
-                self.progress_value = 75
+            result = await self._shared_analysis(cache_key, source, section, token)
 
-            y, sr = librosa.load(audio_file, sr=None)
-            duration = librosa.get_duration(y=y, sr=sr)
-            tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-            
-            half_tempo = tempo / 2
-            double_tempo = tempo * 2
-            
             async with self:
-                self.temp_dir = temp_dir
-                self.audio_file = audio_file
-                self.audio_duration = duration
-                self.bpm = round(float(tempo), 2)
-                self.half_bpm = round(float(half_tempo), 2)
-                self.double_bpm = round(float(double_tempo), 2)
-                self.update_beat_times()
-                self.progress_value = 100
-                self.status = f"Análisis completado. BPM: {self.bpm} (Lento: {self.half_bpm}, Rápido: {self.double_bpm})"
+                self._apply_analysis(result)
+            await self._update_beat_grid(token)
 
+        except JobCancelled:
+            # Whoever cancelled the job has already taken over the status line.
+            pass
         except Exception as e:
             async with self:
                 self.status = f"Error: {str(e)}"
                 self.show_thumbnail = False
         finally:
-            async with self:
-                self.is_processing = False
+            await self._finish_job("analysis", token)
 
-    async def handle_upload(self, files: list[rx.UploadFile]):
-        """Handle the upload of file(s)."""
-        for file in files:
-            upload_data = await file.read()
-            outfile = rx.get_upload_dir() / file.filename
+    def start_upload(self, _value: str):
+        """Send the file picked in the upload input to the streaming upload route."""
+        ticket = issue_ticket(self.router.session.client_token)
+        url = f"{rx.config.get_config().api_url}{UPLOAD_ROUTE}?ticket={ticket}"
+        self.status = "Subiendo el archivo..."
+        return rx.call_script(
+            UPLOAD_SCRIPT.format(input_id=UPLOAD_INPUT_ID, url=url, ticket=ticket),
+            callback=State.finish_upload,
+        )
 
-            # Save the file
-            with outfile.open("wb") as file_object:
-                file_object.write(upload_data)
+    def finish_upload(self, ticket: str):
+        """Take over the file the upload route saved; the hash computed on the way is the cache key."""
+        session_id = self.router.session.client_token
+        upload = take_upload(ticket, session_id)
+        if upload is None:
+            self.status = "La subida no se completó."
+            return
+        if 'error' in upload:
+            self.status = upload['error']
+            return
 
-            # Update the uploaded_audio var
-            self.uploaded_audio = str(outfile)
-            self.status = f"Archivo de audio subido: {file.filename}"
+        # The previous upload is no longer needed once the new one is in.
+        if self._upload_dir:
+            artifact_store.release(session_id, self._upload_dir)
+        self._upload_dir = upload['dir']
+        self.uploaded_audio = upload['path']
+        self._upload_hash = upload['digest']
+        self.status = f"Archivo de audio subido: {upload['filename']}"
 
         # Trigger the analysis event
         return State.trigger_analysis
@@ -150,136 +284,193 @@ class State(rx.State):
                 self.status = "No se ha subido ningún archivo de audio."
             return
 
+        token = self._start_job("analysis", supersedes=("download", "clean_audio", "render", "tempo"))
         try:
             async with self:
                 self.is_processing = True
                 self.progress_value = 0
                 self.status = "Analizando el audio subido..."
 
-            y, sr = librosa.load(self.uploaded_audio, sr=None)
-            duration = librosa.get_duration(y=y, sr=sr)
-            tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-            
-            half_tempo = tempo / 2
-            double_tempo = tempo * 2
-            
+            digest = self._upload_hash or await self._run_job(
+                "Calculando huella del archivo...", file_hash, self.uploaded_audio, kind="io", token=token
+            )
+            section = self._section()
+            cache_key = upload_key(digest, section)
+            result = await self._shared_analysis(cache_key, self.uploaded_audio, section, token)
+
             async with self:
-                self.audio_file = self.uploaded_audio
-                self.audio_duration = duration
-                self.bpm = round(float(tempo), 2)
-                self.half_bpm = round(float(half_tempo), 2)
-                self.double_bpm = round(float(double_tempo), 2)
-                self.update_beat_times()
-                self.progress_value = 100
-                self.status = f"Análisis completado. BPM: {self.bpm} (Lento: {self.half_bpm}, Rápido: {self.double_bpm})"
+                self._apply_analysis(result)
+            await self._update_beat_grid(token)
 
+        except JobCancelled:
+            pass
         except Exception as e:
             async with self:
                 self.status = f"Error en el análisis: {str(e)}"
         finally:
-            async with self:
-                self.is_processing = False
+            await self._finish_job("analysis", token)
 
     @rx.background
     async def trigger_analysis(self):
         """Trigger the analysis of the uploaded audio."""
         yield State.analyze_uploaded_audio
 
-    def update_beat_times(self):
-        if self.tempo_option == "slow":
-            bpm = self.half_bpm
-        elif self.tempo_option == "fast":
-            bpm = self.double_bpm
-        else:
-            bpm = self.bpm
-        
-        beat_duration = 60 / bpm
-        self.beat_times = np.arange(0, self.audio_duration, beat_duration).tolist()
-
-    def set_tempo_option(self, option: str):
-        self.tempo_option = option
-        self.update_beat_times()
-        if option == "slow":
-            self.status = f"Tempo establecido a lento: {self.half_bpm} BPM"
-        elif option == "fast":
-            self.status = f"Tempo establecido a rápido: {self.double_bpm} BPM"
-        else:
-            self.status = f"Tempo establecido a normal: {self.bpm} BPM"
-
-    async def download_progress_hook(self, d):
-        if d['status'] == 'downloading':
-            p = d.get('_percent_str', '0%')
-            p = re.sub(r'\x1b\[[0-9;]*[a-zA-Z]', '', p)
-            p = p.replace('%', '').strip()
-            try:
-                percentage = float(p)
-                progress = int(percentage / 2)
-                async with self:
-                    self.progress_value = progress
-            except ValueError:
-                print(f"No se pudo convertir el porcentaje: {p}")
+    def _grid(self):
+        return BeatGrid.from_dict(self._beat_grid)
+
+    def _tempo_factor(self):
+        return {"slow": 0.5, "fast": 2}.get(self.tempo_option, 1)
+
+    async def _snap_grid(self, factor, token):
+        """The base grid at ``factor`` times its tempo, re-tracked on the stored onset envelope when there is one.
+
+        Re-tracking reads the whole envelope, so it runs on the CPU pool.
+        """
+        grid = BeatGrid.from_dict(self._base_grid).scaled(factor)
+        if factor == 1 or not self._onset_file or not os.path.exists(self._onset_file):
+            return grid
+        return await scheduler.run(
+            self.router.session.client_token, retrack, self._onset_file, grid, kind="cpu", token=token
+        )
+
+    def _set_beat_grid(self, grid):
+        """Show ``grid`` and hand it to the player; call with the state locked."""
+        self._beat_grid = grid.to_dict()
+        player = get_player(self.router.session.client_token)
+        if player is not None:
+            player.set_grid(grid)
+        self._load_waveform()
+
+    async def _update_beat_grid(self, token):
+        """Re-track the base grid at the chosen tempo option and show it."""
+        grid = await self._snap_grid(self._tempo_factor(), token)
+        async with self:
+            check(token)
+            self._set_beat_grid(grid)
+
+    def _load_waveform(self):
+        """Fetch the chart points of the visible window, with the current beats."""
+        if not self._peaks_file or not os.path.exists(self._peaks_file):
+            self.waveform = []
+            return
+        start, end = self.waveform_start, self.waveform_end
+        beats = self._grid().times(start, end) if self._beat_grid else ()
+        self.waveform = waveform_view(self._peaks_file, start, end, beats)
+
+    def zoom_waveform(self, factor: float):
+        """Zoom the waveform view by ``factor`` (<1 zooms in) around its centre."""
+        center = (self.waveform_start + self.waveform_end) / 2
+        half = min(self.audio_duration, max(1.0, (self.waveform_end - self.waveform_start) * factor)) / 2
+        start = min(max(0.0, center - half), max(0.0, self.audio_duration - 2 * half))
+        self.waveform_start, self.waveform_end = round(start, 2), round(start + 2 * half, 2)
+        self._load_waveform()
+
+    def pan_waveform(self, direction: int):
+        """Move the waveform view half a window left (-1) or right (1)."""
+        span = self.waveform_end - self.waveform_start
+        start = self.waveform_start + direction * span / 2
+        start = min(max(0.0, start), max(0.0, self.audio_duration - span))
+        self.waveform_start, self.waveform_end = round(start, 2), round(start + span, 2)
+        self._load_waveform()
+
+    @rx.background
+    async def set_tempo_option(self, option: str):
+        async with self:
+            self.tempo_option = option
+        if not self._base_grid:
+            return
+        token = self._start_job("tempo")
+        try:
+            await self._update_beat_grid(token)
+            async with self:
+                if option == "slow":
+                    self.status = f"Tempo establecido a lento: {self.half_bpm} BPM"
+                elif option == "fast":
+                    self.status = f"Tempo establecido a rápido: {self.double_bpm} BPM"
+                else:
+                    self.status = f"Tempo establecido a normal: {self.bpm} BPM"
+        except JobCancelled:
+            pass
+        except Exception as e:
+            async with self:
+                self.status = f"Error al ajustar el tempo: {str(e)}"
+        finally:
+            scheduler.finish_job(self.router.session.client_token, "tempo", token)
+
+    async def _publish_progress(self, event):
+        """Apply one merged progress event from a ProgressBridge."""
+        async with self:
+            if 'status' in event:
+                self.status = event['status']
+            if event.get('stage') == 'download':
+                if event.get('total'):
+                    percentage = min(100, int(event['downloaded'] / event['total'] * 100))
+                    self.download_progress = percentage
+                    self.progress_value = 25 + percentage // 4
+                self.download_stats = describe_download(event)
+            elif event.get('stage') == 'analysis':
+                self.progress_value = 50 + int(event['fraction'] * 50)
+            elif 'fraction' in event:
+                self.progress_value = int(event['fraction'] * 100)
 
     def play_preview(self):
-        if not self.audio_file or not self.beat_times:
+        if not self.audio_file or not self._beat_grid:
             self.status = "Por favor, analiza el audio primero."
             return
 
         if self.is_playing:
             self.pause_playback()
         else:
-            self.start_playback()
+            return self.start_playback()
 
     def start_playback(self):
         try:
-            pygame.mixer.init(frequency=44100, size=-16, channels=2, buffer=2048)
-            pygame.mixer.music.load(self.audio_file)
-            
-            duration = 0.05
-            sample_rate = 44100
-            t = np.linspace(0, duration, int(sample_rate * duration), False)
-            tone = np.sin(2 * np.pi * 1000 * t) * 0.5
-            fade = np.linspace(1, 0, len(t))
-            tone = tone * fade
-            stereo_tone = np.column_stack((tone, tone))
-            metronome_sound = pygame.sndarray.make_sound((stereo_tone * 32767).astype(np.int16))
-
+            pcm_file = ensure_pcm(self.audio_file)
+            player = open_player(
+                self.router.session.client_token, pcm_file, open_pcm(pcm_file), self._grid(), self.metronome_volume
+            )
+            player.play()
             self.status = "Reproduciendo con metrónomo..."
             self.is_playing = True
-            pygame.mixer.music.play()
-
-            def playback_thread():
-                start_time = pygame.time.get_ticks()
-                for beat_time in self.beat_times:
-                    if not self.is_playing:
-                        break
-                    current_time = pygame.time.get_ticks() - start_time
-                    wait_time = int(beat_time * 1000) - current_time
-                    if wait_time > 0:
-                        pygame.time.wait(wait_time)
-                    if self.is_playing:
-                        metronome_sound.play()
-                
-                if self.is_playing:
-                    pygame.mixer.music.stop()
-                    self.is_playing = False
-                    self.status = "Reproducción finalizada."
-
-            threading.Thread(target=playback_thread).start()
+            return State.watch_playback
 
         except Exception as e:
             self.status = f"Error en la reproducción: {str(e)}"
             self.is_playing = False
 
+    @rx.background
+    async def watch_playback(self):
+        """Mirror the player's position into the UI until it stops."""
+        player = get_player(self.router.session.client_token)
+        while player is not None and self.is_playing:
+            await asyncio.sleep(0.25)
+            async with self:
+                self.playback_position = round(player.seconds, 1)
+                if player.finished.is_set() and self.is_playing:
+                    self.is_playing = False
+                    self.status = "Reproducción finalizada."
+
     def pause_playback(self):
-        if self.is_playing:
-            pygame.mixer.music.pause()
+        player = get_player(self.router.session.client_token)
+        if self.is_playing and player is not None:
+            player.pause()
             self.is_playing = False
             self.status = "Reproducción pausada."
 
+    def seek_playback(self, value):
+        if isinstance(value, list) and len(value) > 0:
+            value = value[0]
+        self.playback_position = float(value)
+        player = get_player(self.router.session.client_token)
+        if player is not None:
+            player.seek(self.playback_position)
+
     def stop_preview(self):
         if self.is_playing:
-            pygame.mixer.music.stop()
+            close_player(self.router.session.client_token)
+            pygame.mixer.stop()
             self.is_playing = False
+            self.playback_position = 0
             self.status = "Reproducción detenida."
 
     @rx.background
@@ -289,39 +480,203 @@ class State(rx.State):
                 self.status = "Por favor, obtén la información del video primero."
             return
 
+        token = self._start_job("download")
         try:
             async with self:
                 self.is_processing = True
                 self.progress_value = 0
-            
-            def progress_hook(d):
-                asyncio.create_task(self.download_progress_hook(d))
+                self.status = f"Descargando: {self.video_info['title']}"
 
-            ydl_opts = {
-                'outtmpl': os.path.join(self.download_path, '%(title)s.%(ext)s'),
-                'format': 'bestaudio/best',
-                'progress_hooks': [progress_hook],
-            }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                async with self:
-                    self.status = f"Descargando: {self.video_info['title']}"
-                ydl.download([self.url])
+            if self.audio_file and os.path.exists(self.audio_file):
+                # The analysis already fetched this stream; just hand it over.
+                ext = os.path.splitext(self.audio_file)[1].lstrip('.')
+                output_file = os.path.join(self.download_path, export_name(self.video_info['title'], ext))
+                await self._run_job(
+                    f"Descargando: {self.video_info['title']}", shutil.copy2, self.audio_file, output_file,
+                    kind="io", token=token,
+                )
+            else:
+                async with ProgressBridge(self._publish_progress) as bridge:
+                    ydl_opts = {
+                        'outtmpl': os.path.join(self.download_path, '%(title)s.%(ext)s'),
+                        'format': 'bestaudio/best',
+                        'progress_hooks': [cancel_hook(token), bridge.ytdlp_hook()],
+                    }
+                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                        await self._run_job(
+                            f"Descargando: {self.video_info['title']}", ydl.download, [self.url.strip()],
+                            kind="io", token=token,
+                        )
             async with self:
                 self.status = "¡Descarga completada!"
                 self.progress_value = 100
+        except (JobCancelled, yt_dlp.utils.DownloadCancelled):
+            pass
         except Exception as e:
             async with self:
                 self.status = f"Error en la descarga: {str(e)}"
         finally:
+            await self._finish_job("download", token)
+
+    def set_batch_limit(self, value):
+        try:
+            self.batch_limit = max(1, min(BATCH_DOWNLOADS, int(value)))
+        except ValueError:
+            self.status = "Por favor, ingresa un número válido de descargas simultáneas."
+
+    async def _update_batch_item(self, index, **changes):
+        async with self:
+            self.batch_items[index] = {**self.batch_items[index], **changes}
+
+    def _batch_publisher(self, index):
+        """A publish callback that shows progress events on batch item ``index``."""
+        async def publish(event):
+            changes = {}
+            if 'status' in event:
+                changes['status'] = event['status']
+            if event.get('stage') == 'download' and event.get('total'):
+                changes['progress'] = min(50, int(event['downloaded'] / event['total'] * 50))
+            elif event.get('stage') == 'analysis':
+                changes['progress'] = 50 + int(event['fraction'] * 50)
+            if changes:
+                await self._update_batch_item(index, **changes)
+
+        return publish
+
+    @rx.background
+    async def analyze_batch(self):
+        """Analyze every video of a playlist or of a pasted list of URLs.
+
+        Up to ``batch_limit`` items are downloaded and analyzed at once, all
+        through one yt-dlp session, and each item shows its progress and BPM
+        as soon as it has them. Items are analyzed whole, without the section.
+        """
+        urls = self.url.split()
+        if not urls:
             async with self:
-                self.is_processing = False
+                self.status = "Por favor, ingresa la URL de una playlist o una lista de URLs."
+            return
+
+        token = self._start_job("batch")
+        session_id = self.router.session.client_token
+        try:
+            async with self:
+                self.is_processing = True
+                self.progress_value = 0
+                self.batch_items = []
+                self._batch_files = []
+
+            # Each item downloads into a directory its analysis reserves, then moves into the cache.
+            # Analyses other sessions joined keep their YoutubeDL past this block if the batch is cancelled.
+            with AudioFetcher(tempfile.gettempdir()) as fetcher:
+                items = []
+                for url in urls:
+                    items += await self._run_job("Leyendo la lista...", fetcher.expand, url, kind="io", token=token)
+                items = list(dict.fromkeys(items))
+                async with self:
+                    self.batch_items = [
+                        {'url': url, 'title': url, 'status': "En espera", 'progress': 0, 'bpm': 0} for url in items
+                    ]
+                    self._batch_files = [None] * len(items)
+                    self.status = f"Analizando {len(items)} elementos..."
+                    limit = asyncio.Semaphore(self.batch_limit)
+                finished = 0
+
+                async def run_item(index, url):
+                    nonlocal finished
+                    async with limit:
+                        try:
+                            await self._update_batch_item(index, status="Obteniendo información...")
+                            # The batch's own semaphore bounds these, not the session's job limit.
+                            info = await scheduler.run(
+                                session_id, fetcher.resolve, url, kind="io", token=token, counted=False
+                            )
+                            await self._update_batch_item(index, title=info['title'])
+                            result = await shared_analysis(
+                                session_id, info, None, video_key(info['id']),
+                                self._batch_publisher(index), token, fetcher,
+                            )
+                            changes = {'status': "Listo", 'progress': 100, 'bpm': round(result['tempo'], 2)}
+                            async with self:
+                                self._batch_files[index] = [info['title'], result['audio_file']]
+                        except JobCancelled:
+                            changes = {'status': "Cancelado"}
+                        except Exception as e:
+                            changes = {'status': f"Error: {str(e)}"}
+                    finished += 1
+                    await self._update_batch_item(index, **changes)
+                    async with self:
+                        self.progress_value = finished * 100 // len(items)
+
+                await asyncio.gather(*(run_item(i, url) for i, url in enumerate(items)))
+
+            if not token.cancelled:
+                async with self:
+                    done = sum(1 for f in self._batch_files if f)
+                    self.status = f"Lote completado: {done} de {len(items)} elementos analizados."
+        except JobCancelled:
+            pass
+        except Exception as e:
+            async with self:
+                self.status = f"Error en el lote: {str(e)}"
+        finally:
+            await self._finish_job("batch", token)
+
+    @rx.background
+    async def download_batch(self):
+        """Copy the audio of every analyzed batch item to the download folder."""
+        files = [f for f in self._batch_files if f]
+        if not files:
+            async with self:
+                self.status = "Por favor, analiza una lista primero."
+            return
+
+        token = self._start_job("download")
+        # The batch's cache entries are not held by the session; each is held while it is copied.
+        holder = f"copia:{self.router.session.client_token}"
+        try:
+            async with self:
+                self.is_processing = True
+                self.progress_value = 0
+            for i, (title, audio_file) in enumerate(files):
+                ext = os.path.splitext(audio_file)[1].lstrip('.')
+                entry = os.path.dirname(audio_file)
+                artifact_store.hold(holder, entry)
+                try:
+                    await self._run_job(
+                        f"Descargando {i + 1}/{len(files)}: {title}",
+                        shutil.copy2, audio_file, os.path.join(self.download_path, export_name(title, ext)),
+                        kind="io", token=token,
+                    )
+                finally:
+                    artifact_store.release_session(holder)
+                async with self:
+                    self.progress_value = (i + 1) * 100 // len(files)
+            async with self:
+                self.status = f"¡{len(files)} archivos descargados en {self.download_path}!"
+        except JobCancelled:
+            pass
+        except Exception as e:
+            async with self:
+                self.status = f"Error en la descarga: {str(e)}"
+        finally:
+            await self._finish_job("download", token)
 
     def cleanup(self):
-        if self.temp_dir and os.path.exists(self.temp_dir):
-            shutil.rmtree(self.temp_dir, ignore_errors=True)
-        self.temp_dir = ""
+        # Nothing still running for this session should write into what is removed here.
+        scheduler.cancel(self.router.session.client_token)
+        close_player(self.router.session.client_token)
+        self.is_playing = False
+        self.is_processing = False
+        artifact_store.release_session(self.router.session.client_token)
+        # An analysis other sessions joined may still be reading the upload; it goes once released.
+        if self._upload_dir and not artifact_store.is_held(self._upload_dir):
+            artifact_store.remove(self._upload_dir)
+        self._upload_dir = ""
+        self._analysis_dir = ""
+        self.uploaded_audio = ""
+        self._upload_hash = ""
         self.audio_file = ""
-        self.cleanup_temp_files()
 
     def set_manual_bpm(self, value):
         try:
@@ -329,116 +684,161 @@ class State(rx.State):
         except ValueError:
             self.status = "Por favor, ingresa un valor numérico válido para BPM."
 
-    def use_manual_bpm(self):
-        if self.manual_bpm > 0:
-            self.bpm = self.manual_bpm
-            self.half_bpm = self.bpm / 2
-            self.double_bpm = self.bpm * 2
-            self.update_beat_times()
-            self.status = f"BPM manual establecido: {self.bpm}"
-        else:
-            self.status = "Por favor, ingresa un valor válido de BPM antes de usar."
+    async def _use_bpm(self, bpm):
+        """Move the base grid to ``bpm``, then re-track the chosen tempo option."""
+        if not self._base_grid:
+            async with self:
+                self.status = "Por favor, analiza el audio primero."
+            return
+        if bpm <= 0:
+            async with self:
+                self.status = "Por favor, ingresa un valor válido de BPM antes de usar."
+            return
+
+        token = self._start_job("tempo")
+        try:
+            # Every local tempo of a segmented grid moves by the same ratio as the reported one.
+            base = await self._snap_grid(bpm / self._tempo, token)
+            async with self:
+                check(token)
+                self._base_grid = base.to_dict()
+                self._tempo = bpm
+                self.bpm = bpm
+                self.half_bpm = self.bpm / 2
+                self.double_bpm = self.bpm * 2
+            await self._update_beat_grid(token)
+            async with self:
+                self.status = f"BPM manual establecido: {self.bpm}"
+        except JobCancelled:
+            pass
+        except Exception as e:
+            async with self:
+                self.status = f"Error al ajustar el tempo: {str(e)}"
+        finally:
+            scheduler.finish_job(self.router.session.client_token, "tempo", token)
+
+    @rx.background
+    async def use_manual_bpm(self):
+        await self._use_bpm(self.manual_bpm)
+
+    @rx.background
+    async def use_tempo_candidate(self, bpm: float):
+        async with self:
+            self.manual_bpm = float(bpm)
+        await self._use_bpm(float(bpm))
 
-    def download_clean_audio(self):
+    @rx.background
+    async def download_clean_audio(self):
         if not self.audio_file:
-            self.status = "Por favor, analiza el audio primero."
+            async with self:
+                self.status = "Por favor, analiza el audio primero."
             return
-        
+
+        token = self._start_job("clean_audio")
         try:
             output_file = os.path.join(self.download_path, f"{self.video_info.get('title', 'audio')}_clean.mp3")
-            shutil.copy2(self.audio_file, output_file)
-            self.status = f"Audio limpio descargado: {output_file}"
+            mp3_file = await self._run_job("Codificando MP3...", mp3_version, self.audio_file, kind="io", token=token)
+            await self._run_job(
+                "Copiando audio limpio...", shutil.copy2, mp3_file, output_file, kind="io", token=token
+            )
+            async with self:
+                self.status = f"Audio limpio descargado: {output_file}"
+        except JobCancelled:
+            pass
         except Exception as e:
-            self.status = f"Error al descargar audio limpio: {str(e)}"
+            async with self:
+                self.status = f"Error al descargar audio limpio: {str(e)}"
+        finally:
+            scheduler.finish_job(self.router.session.client_token, "clean_audio", token)
+
+    def toggle_export_format(self, fmt: str, checked: bool):
+        if checked and fmt not in self.export_formats:
+            self.export_formats.append(fmt)
+        elif not checked and fmt in self.export_formats:
+            self.export_formats.remove(fmt)
+
+    def set_preview_start(self, value):
+        if isinstance(value, list) and len(value) > 0:
+            value = value[0]
+        try:
+            self.preview_start = float(value)
+        except ValueError:
+            print(f"Error: No se pudo convertir '{value}' a float")
 
     def set_metronome_volume(self, value):
         if isinstance(value, list) and len(value) > 0:
             value = value[0]
         try:
             self.metronome_volume = float(value)
+            player = get_player(self.router.session.client_token)
+            if player is not None:
+                player.set_volume(self.metronome_volume)
         except ValueError:
             print(f"Error: No se pudo convertir '{value}' a float")
 
     @rx.background
     async def download_audio_with_metronome(self):
-        if not self.audio_file or not self.beat_times:
+        if not self.audio_file or not self._beat_grid:
             async with self:
                 self.status = "Por favor, analiza el audio primero."
             return
-        
+
+        token = self._start_job("render")
         try:
             async with self:
                 self.is_processing = True
                 self.progress_value = 0
             
-            audio = AudioSegment.from_mp3(self.audio_file)
-            
-            duration_ms = 20
-            metronome_sound = (Sine(880).to_audio_segment(duration=duration_ms)
-                                .fade_in(5).fade_out(15)
-                                .apply_gain(self.metronome_volume))
-            
-            total_beats = len(self.beat_times)
-            for i, beat_time in enumerate(self.beat_times):
-                position_ms = int(beat_time * 1000)
-                audio = audio.overlay(metronome_sound, position=position_ms)
-                async with self:
-                    self.progress_value = int((i + 1) / total_beats * 100)
-            
-            output_file = os.path.join(self.download_path, f"{self.video_info.get('title', 'audio')}_with_metronome.mp3")
-            audio.export(output_file, format="mp3")
-            
+            if not self.export_formats:
+                raise Exception("Selecciona al menos un formato de exportación.")
+            title = self.video_info.get('title', 'audio')
+            outputs = {
+                fmt: os.path.join(self.download_path, f"{title}_with_metronome.{fmt}")
+                for fmt in self.export_formats
+            }
+            async with ProgressBridge(self._publish_progress) as bridge:
+                await render(
+                    self.router.session.client_token, self.audio_file, self._grid(), self.metronome_volume,
+                    outputs, bridge.stage_hook('render'), token,
+                    on_position=self._queue_status("Generando audio con metrónomo..."),
+                )
+
             async with self:
-                self.status = f"Audio con metrónomo descargado: {output_file}"
+                self.status = f"Audio con metrónomo descargado: {', '.join(outputs.values())}"
                 self.progress_value = 100
+        except JobCancelled:
+            pass
         except Exception as e:
             async with self:
                 self.status = f"Error al descargar audio con metrónomo: {str(e)}"
         finally:
-            async with self:
-                self.is_processing = False
+            await self._finish_job("render", token)
 
     def preview_with_metronome(self):
-        if not self.audio_file or not self.beat_times:
+        if not self.audio_file or not self._beat_grid:
             self.status = "Por favor, analiza el audio primero."
             return
 
         try:
-            with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_file:
-                temp_filename = temp_file.name
-
-            self.temp_files.append(temp_filename)
+            pcm_file = ensure_pcm(self.audio_file)
+            # The grid itself, not the numbers it was made from: re-tracking moves beats, not the BPM.
+            key = (pcm_file, json.dumps(self._beat_grid, sort_keys=True), self.metronome_volume, self.preview_start)
+            preview = render_preview(pcm_file, self._grid(), self.metronome_volume, self.preview_start, key)
+            preview_duration = len(preview) * 1000 // PCM_SR
 
-            audio = AudioSegment.from_mp3(self.audio_file)
-
-            duration_ms = 20
-            metronome_sound = (Sine(880).to_audio_segment(duration=duration_ms).fade_in(5).fade_out(15)
-                                .apply_gain(self.metronome_volume))
-
-            preview_duration = min(10000, len(audio))
-            preview_audio = audio[:preview_duration]
-
-            for beat_time in self.beat_times:
-                if beat_time * 1000 > preview_duration:
-                    break
-                position_ms = int(beat_time * 1000)
-                preview_audio = preview_audio.overlay(metronome_sound, position=position_ms)
-
-            preview_audio.export(temp_filename, format="mp3")
-
-            pygame.mixer.init(frequency=44100, size=-16, channels=2, buffer=2048)
-            pygame.mixer.music.load(temp_filename)
-            pygame.mixer.music.play()
+            # Played from memory: no temp file, no MP3 round-trip.
+            pygame.mixer.init(frequency=PCM_SR, size=-16, channels=2, buffer=2048)
+            pygame.mixer.stop()
+            pygame.mixer.Sound(buffer=preview.tobytes()).play()
 
             self.status = "Reproduciendo vista previa con metrónomo..."
             self.is_playing = True
 
             def cleanup():
                 pygame.time.wait(int(preview_duration))
-                pygame.mixer.music.stop()
+                pygame.mixer.stop()
                 self.is_playing = False
                 self.status = "Vista previa finalizada."
-                self.cleanup_temp_files()
 
             threading.Thread(target=cleanup).start()
 
@@ -446,14 +846,14 @@ class State(rx.State):
             self.status = f"Error en la vista previa: {str(e)}"
             self.is_playing = False
 
-    def cleanup_temp_files(self):
-        for file in self.temp_files:
-            try:
-                if os.path.exists(file):
-                    os.unlink(file)
-            except PermissionError:
-                print(f"No se pudo eliminar {file}. Se intentará más tarde.")
-        self.temp_files = [f for f in self.temp_files if os.path.exists(f)]
+    def cancel_jobs(self):
+        """Stop everything this session has queued or running."""
+        scheduler.cancel(self.router.session.client_token)
+        self.is_processing = False
+        self.progress_value = 0
+        self.download_progress = 0
+        self.download_stats = ""
+        self.status = "Operación cancelada."
 
 def index():
     return rx.box(
@@ -475,8 +875,8 @@ def index():
         rx.box(
             rx.vstack(
                 rx.heading("Analizador de Audio con Metrónomo", size="lg", color="white"),
-                rx.input(
-                    placeholder="Ingresa la URL del video de YouTube",
+                rx.text_area(
+                    placeholder="Ingresa la URL del video de YouTube, de una playlist o varias URLs (una por línea)",
                     on_change=State.set_url,
                     width="100%",
                     bg="rgba(255, 255, 255, 0.1)",
@@ -485,22 +885,32 @@ def index():
                     _placeholder={"color": "rgba(255, 255, 255, 0.5)"},
                 ),
                 rx.text("O", color="white", font_weight="bold"),
-                rx.upload(
-                    rx.text(
-                        "Arrastra y suelta tu archivo de audio aquí o haz clic para seleccionar"
-                    ),
-                    id="audio_upload",
+                rx.text(
+                    "Arrastra y suelta tu archivo de audio aquí o haz clic para seleccionar",
+                    color="white",
+                ),
+                # A plain file input: the browser streams the file to the backend route.
+                rx.el.input(
+                    type="file",
+                    id=UPLOAD_INPUT_ID,
+                    accept="audio/*,.mp3,.wav,.flac,.aac,.ogg,.m4a",
+                    on_change=State.start_upload,
                     border="1px dotted rgb(107,99,246)",
                     padding="2em",
-                    multiple=False,
-                    accept={
-                        "audio/*": [".mp3", ".wav", ".flac", ".aac", ".ogg", ".m4a"]
-                    },
-                    max_files=1,
-                    on_drop=State.handle_upload(rx.upload_files(upload_id="audio_upload")),
+                    width="100%",
+                    color="white",
                 ),
                 rx.hstack(
-                    rx.foreach(rx.selected_files("audio_upload"), rx.text),
+                    rx.input(
+                        placeholder="Inicio de la sección (mm:ss)",
+                        on_change=State.set_section_start,
+                        width="50%",
+                    ),
+                    rx.input(
+                        placeholder="Fin de la sección (mm:ss)",
+                        on_change=State.set_section_end,
+                        width="50%",
+                    ),
                     width="100%",
                 ),
                 rx.hstack(
@@ -546,6 +956,55 @@ def index():
                     width="100%",
                     justify="space-between",
                 ),
+                rx.hstack(
+                    rx.button(
+                        "Analizar lista",
+                        on_click=State.analyze_batch,
+                        bg="#4CAF50",
+                        color="white",
+                        _hover={"bg": "#45a049"},
+                    ),
+                    rx.input(
+                        placeholder=f"Descargas simultáneas (máx. {BATCH_DOWNLOADS})",
+                        on_change=State.set_batch_limit,
+                        type="number",
+                        width="40%",
+                    ),
+                    rx.button(
+                        "Descargar lista",
+                        on_click=State.download_batch,
+                        bg="#2196F3",
+                        color="white",
+                        _hover={"bg": "#1E88E5"},
+                    ),
+                    width="100%",
+                    justify="space-between",
+                ),
+                rx.cond(
+                    State.batch_items.length() > 0,
+                    rx.vstack(
+                        rx.foreach(
+                            State.batch_items,
+                            lambda item: rx.vstack(
+                                rx.hstack(
+                                    rx.text(item['title'], color="white"),
+                                    rx.cond(
+                                        item['bpm'],
+                                        rx.text(f"{item['bpm']} BPM", color="white", font_weight="bold"),
+                                    ),
+                                    width="100%",
+                                    justify="space-between",
+                                ),
+                                rx.progress(value=item['progress'].to(int)),
+                                rx.text(item['status'], color="rgba(255, 255, 255, 0.7)"),
+                                width="100%",
+                            ),
+                        ),
+                        width="100%",
+                        max_height="400px",
+                        overflow_y="auto",
+                    ),
+                ),
                 rx.hstack(
                     rx.input(
                         placeholder="BPM manual",
@@ -563,6 +1022,53 @@ def index():
                     width="100%",
                     justify="space-between",
                 ),
+                rx.cond(
+                    State.waveform.length() > 0,
+                    rx.vstack(
+                        rx.recharts.composed_chart(
+                            rx.recharts.area(data_key="max", stroke="#90CAF9", fill="#90CAF9"),
+                            rx.recharts.area(data_key="min", stroke="#90CAF9", fill="#90CAF9"),
+                            rx.recharts.bar(data_key="beat", fill="#FF9800", bar_size=2),
+                            rx.recharts.line(data_key="onset", stroke="#E91E63", dot=False),
+                            rx.recharts.x_axis(data_key="t"),
+                            rx.recharts.y_axis(domain=[-1, 1], hide=True),
+                            data=State.waveform,
+                            height=200,
+                            width="100%",
+                        ),
+                        rx.hstack(
+                            rx.button("◀", on_click=State.pan_waveform(-1)),
+                            rx.button("Acercar", on_click=State.zoom_waveform(0.5)),
+                            rx.button("Alejar", on_click=State.zoom_waveform(2)),
+                            rx.button("▶", on_click=State.pan_waveform(1)),
+                            rx.text(f"{State.waveform_start} – {State.waveform_end} s", color="white"),
+                            width="100%",
+                            justify="space-between",
+                        ),
+                        width="100%",
+                    ),
+                ),
+                rx.cond(
+                    State.tempo_candidates.length() > 0,
+                    rx.vstack(
+                        rx.text("Tempos candidatos:", color="white"),
+                        rx.hstack(
+                            rx.foreach(
+                                State.tempo_candidates,
+                                lambda candidate: rx.button(
+                                    f"{candidate['bpm']} BPM ({candidate['confidence']}%)",
+                                    on_click=State.use_tempo_candidate(candidate['bpm']),
+                                    bg="#795548",
+                                    color="white",
+                                    _hover={"bg": "#6D4C41"},
+                                ),
+                            ),
+                            wrap="wrap",
+                            width="100%",
+                        ),
+                        width="100%",
+                    ),
+                ),
                 rx.hstack(
                     rx.button(
                         "Descargar Audio Limpio",
@@ -581,6 +1087,35 @@ def index():
                     width="100%",
                     justify="space-between",
                 ),
+                rx.hstack(
+                    rx.text("Formatos:", color="white"),
+                    rx.checkbox(
+                        "WAV",
+                        checked=State.export_formats.contains("wav"),
+                        on_change=lambda checked: State.toggle_export_format("wav", checked),
+                        color="white",
+                    ),
+                    rx.checkbox(
+                        "FLAC",
+                        checked=State.export_formats.contains("flac"),
+                        on_change=lambda checked: State.toggle_export_format("flac", checked),
+                        color="white",
+                    ),
+                    rx.checkbox(
+                        "MP3",
+                        checked=State.export_formats.contains("mp3"),
+                        on_change=lambda checked: State.toggle_export_format("mp3", checked),
+                        color="white",
+                    ),
+                    rx.checkbox(
+                        "Opus",
+                        checked=State.export_formats.contains("opus"),
+                        on_change=lambda checked: State.toggle_export_format("opus", checked),
+                        color="white",
+                    ),
+                    width="100%",
+                    justify="space-between",
+                ),
                 rx.hstack(
                     rx.button(
                         "Lento",
@@ -616,6 +1151,24 @@ def index():
                         on_change=State.set_metronome_volume,
                         width="100%",
                     ),
+                    rx.text(f"Posición de reproducción: {State.playback_position} s", color="white"),
+                    rx.slider(
+                        min=0,
+                        max=State.audio_duration,
+                        step=1,
+                        value=[State.playback_position],
+                        on_change=State.seek_playback,
+                        width="100%",
+                    ),
+                    rx.text(f"Inicio de la vista previa: {State.preview_start} s", color="white"),
+                    rx.slider(
+                        min=0,
+                        max=State.audio_duration,
+                        step=1,
+                        default_value=0,
+                        on_change=State.set_preview_start,
+                        width="100%",
+                    ),
                     rx.button(
                         "Vista Previa con Metrónomo",
                         on_click=State.preview_with_metronome,
@@ -653,16 +1206,25 @@ def index():
                     rx.vstack(
                         rx.text("Procesando...", color="white"),
                         rx.progress(value=State.progress_value),
+                        rx.button(
+                            "Cancelar",
+                            on_click=State.cancel_jobs,
+                            bg="#F44336",
+                            color="white",
+                            _hover={"bg": "#E53935"},
+                        ),
                         width="100%",
                     ),
                 ),
                 rx.text(State.status, color="rgba(255, 255, 255, 0.7)"),
                 rx.text(f"BPM: {State.bpm} (Lento: {State.half_bpm}, Normal: {State.bpm}, Rápido: {State.double_bpm})", color="rgba(255, 255, 255, 0.7)"),
+                rx.text(f"Caché: {State.cache_hits} aciertos, {State.cache_misses} fallos", color="rgba(255, 255, 255, 0.5)"),
                 rx.cond(
                     State.download_progress > 0,
                     rx.vstack(
                         rx.text("Progreso de descarga:", color="white"),
                         rx.progress(value=State.download_progress),
+                        rx.text(State.download_stats, color="rgba(255, 255, 255, 0.7)"),
                         width="100%",
                     ),
                 ),
@@ -685,5 +1247,41 @@ def index():
         overflow="hidden",
     )
 
+async def _warm_up_server():
+    """Warm up this process (re-tracking runs here) and every analysis worker."""
+    if not WARM_UP:
+        return
+    started = time.perf_counter()
+    await asyncio.to_thread(warm_up)
+    await scheduler.start("cpu")
+    print(f"[arranque] Servidor y procesos de análisis preparados en {time.perf_counter() - started:.2f} s")
+
+
+def _serve_metrics():
+    """Publish stage timings, temporary files and cache counters on the local metrics endpoint."""
+    registry.gauge("descargas_artifact_bytes", "Bytes held in temporary artifacts.",
+                   lambda: artifact_store.stats()["bytes_held"])
+    registry.gauge("descargas_artifact_reclaimed_bytes_total", "Bytes of temporary artifacts removed.",
+                   lambda: artifact_store.bytes_reclaimed, kind="counter")
+    registry.gauge("descargas_artifact_evictions_total", "Artifacts evicted to make room.",
+                   lambda: artifact_store.evictions, kind="counter")
+    registry.gauge("descargas_cache_hits_total", "Analysis cache hits.", lambda: analysis_cache.hits, kind="counter")
+    registry.gauge("descargas_cache_misses_total", "Analysis cache misses.",
+                   lambda: analysis_cache.misses, kind="counter")
+    if not METRICS_PORT:
+        return
+    try:
+        serve(METRICS_PORT)
+    except OSError as e:
+        print(f"[métricas] No se pudo abrir el puerto {METRICS_PORT}: {e}")
+        return
+    print(f"[métricas] Disponibles en http://127.0.0.1:{METRICS_PORT}/metrics")
+
+
 app = rx.App()
-app.add_page(index)
\ No newline at end of file
+app.add_page(index)
+app.api.add_api_route(UPLOAD_ROUTE, receive_upload, methods=["POST"])
+app.register_lifespan_task(_warm_up_server)
+app.register_lifespan_task(artifact_store.start_janitor)
+app.register_lifespan_task(_serve_metrics)
+print(f"[arranque] Módulo cargado en {time.perf_counter() - _IMPORT_STARTED:.2f} s")
\ No newline at end of file
@@ -0,0 +1,211 @@
+import functools
+import os
+import tempfile
+import time
+
+from .analysis import HOP_LENGTH, analyze_audio, artifact_bytes, stitch_segments, track_segment
+from .artifacts import artifact_store
+from .audio import cut_section, probe_duration
+from .beatgrid import BeatGrid
+from .cache import analysis_cache, file_hash, upload_key, video_key
+from .fetch import AudioFetcher
+from .jobs import flights, scheduler
+from .pcm import PCM_CHANNELS, PCM_SR
+from .progress import ProgressBridge
+from .render import render_with_metronome
+
+_first_analysis_logged = False
+
+
+async def _ignore(event):
+    pass
+
+
+async def analyze_track(session_id, source, section, cache_key, publish, token, fetcher=None):
+    """Fetch and analyze one track, then store it in the analysis cache.
+
+    ``source`` is a resolved yt-dlp info dict or the path of a local file;
+    with a ``(start, end)`` ``section`` only that range is fetched or cut out
+    and analyzed. Run it through :func:`analyze`, or ``flights`` directly, so
+    ``publish`` reaches every caller waiting on ``cache_key``; status lines
+    travel as ``{'status': ...}`` events. With a shared ``fetcher`` every
+    stage runs outside the session's job limit: whoever shares it (a batch
+    and its semaphore) bounds how many tracks are in flight.
+    """
+    global _first_analysis_logged
+    started = time.perf_counter()
+    temp_dir = work_dir = None
+    counted = fetcher is None
+    # Sessions joining this flight read the caller's upload, so the flight holds it
+    # until it is in the cache; the caller's «Limpiar» then only releases it.
+    holder = f"flight:{cache_key}"
+    if isinstance(source, str):
+        artifact_store.hold(holder, os.path.dirname(source))
+    async with ProgressBridge(publish) as bridge:
+        async def stage(label, fn, *args, kind="cpu"):
+            async def on_position(position):
+                bridge.put({'status': f"En cola (posición {position})..." if position else label})
+
+            bridge.put({'status': label})
+            return await scheduler.run(
+                session_id, fn, *args, kind=kind, on_position=on_position, token=token, counted=counted
+            )
+
+        try:
+            # Every directory reserves what will be written to it, so the quotas hold
+            # for downloads and decodes too, not just for what exists when they start.
+            if isinstance(source, dict):
+                seconds = source.get('duration')
+            else:
+                seconds = await stage("Leyendo el archivo...", probe_duration, source, kind="io")
+            if seconds and section:
+                seconds = (section[1] if section[1] is not None else seconds) - section[0]
+            # Derived artifacts get a directory of their own: a job replacing this one
+            # (same source, same names) may be writing its own while this one winds down.
+            work_dir = artifact_store.create_dir(session_id, "analisis", artifact_bytes(seconds or 0))
+            if isinstance(source, dict):
+                temp_dir = artifact_store.create_dir(session_id, "descarga", download_bytes(source, seconds))
+                # Analysis decodes the native stream; no MP3 is made unless asked for.
+                if fetcher is not None:
+                    audio_file = await stage(
+                        "Descargando audio...",
+                        functools.partial(
+                            fetcher.download, source, section, progress_hooks=[bridge.ytdlp_hook()], token=token,
+                            dest_dir=temp_dir,
+                        ),
+                        kind="io",
+                    )
+                else:
+                    with AudioFetcher(temp_dir, progress_hooks=[bridge.ytdlp_hook()], token=token) as own:
+                        audio_file = await stage(
+                            "Descargando audio...", own.download, source, section, kind="io"
+                        )
+                # Everything lives in our temp dir, so it can all move into the cache.
+                move = True
+            elif section:
+                # The cut is a 16-bit stereo WAV.
+                temp_dir = artifact_store.create_dir(
+                    session_id, "seccion", int((seconds or 0) * PCM_SR * PCM_CHANNELS * 2)
+                )
+                audio_file = await stage("Recortando la sección...", cut_section, source, section, temp_dir, kind="io")
+                move = True
+            else:
+                audio_file = source
+                # The file stays where it is; only the derived artifacts move.
+                move = {'pcm_file', 'onset_file', 'peaks_file'}
+
+            bridge.put({'stage': 'analysis', 'fraction': 0})
+            analysis = await stage(
+                "Analizando el audio...",
+                functools.partial(
+                    analyze_audio, audio_file, progress_queue=bridge.process_queue(), token=token,
+                    segmented=True, work_dir=work_dir,
+                ),
+            )
+            if 'segments' in analysis:
+                # Long track: beats are tracked per segment on every free worker.
+                segments = analysis.pop('segments')
+                bridge.put({'status': f"Detectando pulsos en {len(segments)} segmentos..."})
+                tracked = await scheduler.map(
+                    session_id, functools.partial(track_segment, analysis['onset_file']), segments, token=token
+                )
+                analysis.update(stitch_segments(tracked, segments))
+            files = {
+                'audio_file': audio_file,
+                'pcm_file': analysis.pop('pcm_file'),
+                'onset_file': analysis.pop('onset_file'),
+                'peaks_file': analysis.pop('peaks_file'),
+            }
+            analysis['section'] = list(section) if section else None
+            result = await stage(
+                "Guardando el análisis...",
+                functools.partial(analysis_cache.put, cache_key, files, move=move, **analysis),
+                kind="io",
+            )
+            if not _first_analysis_logged:
+                _first_analysis_logged = True
+                print(f"[arranque] Primer análisis del proceso: {time.perf_counter() - started:.2f} s")
+            return result
+        finally:
+            artifact_store.release_session(holder)
+            if temp_dir:
+                artifact_store.remove(temp_dir)
+            if work_dir:
+                artifact_store.remove(work_dir)
+
+
+async def shared_analysis(session_id, source, section, cache_key, publish=_ignore, token=None, fetcher=None):
+    """The cached analysis of ``cache_key``, or the result of running (or joining) it."""
+    result = analysis_cache.get(cache_key)
+    # Entries analyzed at another hop length have envelopes retrack cannot read.
+    if result and result.get('hop_length') == HOP_LENGTH:
+        return result
+    work = functools.partial(analyze_track, session_id, source, section, cache_key, fetcher=fetcher)
+    return await flights.join(cache_key, work, publish, token)
+
+
+async def analyze(item, session_id, section=None, publish=_ignore, token=None, fetcher=None):
+    """Analyze a URL or a local file path; return ``(title, result)``.
+
+    Batches pass one ``fetcher`` for all their URLs, so they share its connections.
+    """
+    if os.path.isfile(item):
+        digest = await scheduler.run(session_id, file_hash, item, kind="io", token=token)
+        cache_key = upload_key(digest, section)
+        title = os.path.splitext(os.path.basename(item))[0]
+        source = item
+    else:
+        if fetcher is not None:
+            source = await scheduler.run(session_id, fetcher.resolve, item, kind="io", token=token, counted=False)
+        else:
+            with AudioFetcher(tempfile.gettempdir(), token=token) as own:
+                source = await scheduler.run(session_id, own.resolve, item, kind="io", token=token)
+        cache_key, title = video_key(source['id'], section), source['title']
+    return title, await shared_analysis(session_id, source, section, cache_key, publish, token, fetcher)
+
+
+def download_bytes(info, seconds=None):
+    """Estimated size of the ``bestaudio`` download of ``info``, ``seconds`` of it if given."""
+    size = info.get('filesize') or info.get('filesize_approx')
+    duration = info.get('duration')
+    if not size:
+        # Without a size, the bitrate (kbit/s) gives one; 320 kbit/s is a safe guess without either.
+        size = (duration or 0) * (info.get('abr') or info.get('tbr') or 320) * 125
+    if seconds and duration:
+        size *= min(1.0, seconds / duration)
+    return int(size)
+
+
+def beat_grid(result):
+    """The :class:`BeatGrid` of an analysis result, on the analyzed audio's timeline."""
+    frame_seconds = result.get('hop_length', 512) / result['sr']
+    beat_times = [frame * frame_seconds for frame in result['beat_frames']]
+    section = result.get('section')
+    # Segmented analyses carry a local tempo per segment.
+    tempo_map = result.get('tempo_map') or [(0.0, result['tempo'])]
+    return BeatGrid.from_beats(
+        beat_times, tempo_map[0][1], result['duration'], tempo_map[1:], offset=section[0] if section else 0.0
+    )
+
+
+def summary(result):
+    """The figures a user asks for: tempo, half and double tempo, duration and grid."""
+    tempo = result['tempo']
+    return {
+        'bpm': round(tempo, 2),
+        'half_bpm': round(tempo / 2, 2),
+        'double_bpm': round(tempo * 2, 2),
+        'duration': round(result['duration'], 3),
+        'grid': beat_grid(result).to_dict(),
+        'tempo_candidates': result.get('tempo_candidates', []),
+    }
+
+
+async def render(session_id, audio_file, grid, volume, outputs, progress=None, token=None, on_position=None):
+    """Mix the metronome into an analyzed track; ``outputs`` maps formats to paths."""
+    # Mixing is a few vectorized NumPy calls and the rest is ffmpeg, neither of
+    # which holds the GIL for long, so a thread is enough.
+    return await scheduler.run(
+        session_id, render_with_metronome, audio_file, grid, volume, outputs, progress, token,
+        kind="io", on_position=on_position, token=token,
+    )
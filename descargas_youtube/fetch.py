@@ -0,0 +1,168 @@
+import contextlib
+import os
+import threading
+import time
+
+from .jobs import JobCancelled
+from .lazy import lazy_import
+from .metrics import Span
+
+yt_dlp = lazy_import("yt_dlp")
+
+# Stream URLs of a resolved video expire after a few hours; older ones are resolved again.
+RESOLVED_MAX_AGE = 3600
+
+
+class AudioFetcher:
+    """A yt-dlp session that resolves a URL once and downloads from it.
+
+    ``resolve`` runs the extractor and format selection; ``download`` hands
+    that same info dict to ``process_ie_result`` so the video page is never
+    fetched twice. The ``bestaudio`` stream is kept in its native container.
+
+    With a cancel ``token`` the download stops at the next fragment or chunk
+    once it is cancelled and :class:`JobCancelled` is raised.
+
+    One fetcher can download several videos at once from worker threads (a
+    batch shares its connections this way); ``download`` then takes the hooks
+    and token of each video, and events are routed to them by video id.
+    A ``YoutubeDL`` is not thread-safe, so every call checks one out for
+    itself: there are as many as calls ever ran at once, each reused later.
+    Leaving the ``with`` block closes the idle ones; a download still running
+    (an analysis other sessions joined) closes its own when it finishes.
+
+    ``expand`` keeps what it resolved of a single video, and ``resolve``
+    hands that back instead of running the extractor again.
+    """
+
+    def __init__(self, dest_dir, progress_hooks=(), token=None):
+        self.dest_dir = dest_dir
+        hooks = list(progress_hooks)
+        if token is not None:
+            hooks.insert(0, cancel_hook(token))
+        self._hooks = [*hooks, self._route]
+        self._routes = {}
+        self._idle = []
+        self._closed = False
+        self._resolved = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._closed = True
+        for ydl in idle:
+            ydl.__exit__(None, None, None)
+
+    @contextlib.contextmanager
+    def _ydl(self):
+        """A ``YoutubeDL`` no other thread is using until the block ends."""
+        with self._lock:
+            ydl = self._idle.pop() if self._idle else None
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL({
+                'quiet': True,
+                'format': 'bestaudio/best',
+                'outtmpl': os.path.join(self.dest_dir, '%(id)s.%(ext)s'),
+                'progress_hooks': list(self._hooks),
+            }).__enter__()
+        try:
+            yield ydl
+        finally:
+            with self._lock:
+                closed = self._closed
+                if not closed:
+                    self._idle.append(ydl)
+            if closed:
+                ydl.__exit__(None, None, None)
+
+    def resolve(self, url):
+        with self._lock:
+            resolved_at, info = self._resolved.pop(url, (0, None))
+        if info is not None and time.monotonic() - resolved_at < RESOLVED_MAX_AGE:
+            return info
+        with Span("extract_info") as span, self._ydl() as ydl:
+            info = ydl.extract_info(url, download=False)
+            span.track_seconds = info.get('duration')
+        return info
+
+    def expand(self, url):
+        """The video URLs of a playlist, or ``[url]`` for anything else.
+
+        Playlist entries are listed without resolving each video; a single
+        video is resolved here already, for ``resolve`` to reuse.
+        """
+        # Unprocessed, a playlist comes back as bare references to its videos,
+        # and a video as its extracted page, which only lacks format selection.
+        with Span("extract_info") as span, self._ydl() as ydl:
+            info = ydl.extract_info(url, download=False, process=False)
+            if info.get('_type') not in ('playlist', 'multi_video', 'url', 'url_transparent'):
+                info = ydl.process_ie_result(info, download=False)
+                span.track_seconds = info.get('duration')
+                with self._lock:
+                    self._resolved[url] = (time.monotonic(), info)
+                return [url]
+        if info.get('_type') not in ('playlist', 'multi_video'):
+            return [url]
+        return [entry.get('url') or entry.get('webpage_url') for entry in info.get('entries') or [] if entry]
+
+    def _route(self, d):
+        for hook in self._routes.get(d.get('info_dict', {}).get('id'), ()):
+            hook(d)
+
+    def download(self, info, section=None, progress_hooks=(), token=None, dest_dir=None):
+        """Download a resolved ``info`` dict and return the local file path.
+
+        With a ``(start, end)`` ``section`` in seconds only that range is
+        fetched (yt-dlp cuts it with ffmpeg as it downloads).
+        ``progress_hooks``, ``token`` and ``dest_dir`` (instead of the
+        fetcher's) apply to this video only.
+        """
+        dest_dir = dest_dir or self.dest_dir
+        hooks = list(progress_hooks)
+        if token is not None:
+            hooks.insert(0, cancel_hook(token))
+        video_id = info['id']
+        self._routes[video_id] = hooks
+        with Span("download", track_seconds=info.get('duration')) as span, self._ydl() as ydl:
+            # The range belongs to this call: no other thread uses ``ydl`` meanwhile.
+            # An open end is infinite to yt-dlp; a stream copy would start on the
+            # packet before ``start``, so the cut is re-encoded (as in ``cut_section``).
+            # Without one the key must be absent: yt-dlp calls whatever it holds.
+            if section:
+                ydl.params['download_ranges'] = yt_dlp.utils.download_range_func(
+                    None, [(section[0], float('inf') if section[1] is None else section[1])]
+                )
+            else:
+                ydl.params.pop('download_ranges', None)
+            ydl.params['force_keyframes_at_cuts'] = bool(section)
+            ydl.params['outtmpl'] = {'default': os.path.join(dest_dir, '%(id)s.%(ext)s')}
+            try:
+                info = ydl.process_ie_result(info, download=True)
+            except yt_dlp.utils.DownloadCancelled:
+                raise JobCancelled()
+            finally:
+                del self._routes[video_id]
+            downloads = info.get('requested_downloads') or []
+            audio_file = downloads[0].get('filepath') if downloads else None
+            audio_file = audio_file or ydl.prepare_filename(info)
+            if not os.path.exists(audio_file):
+                raise Exception(f"No se encontró ningún archivo de audio en: {dest_dir}")
+            span.bytes = os.path.getsize(audio_file)
+        return audio_file
+
+
+def cancel_hook(token):
+    """A yt-dlp progress hook that aborts the download once ``token`` is cancelled."""
+    def hook(d):
+        if token.cancelled:
+            raise yt_dlp.utils.DownloadCancelled("Descarga cancelada")
+    return hook
+
+
+def export_name(title, ext):
+    """File name used for files saved to the user's download folder."""
+    return f"{yt_dlp.utils.sanitize_filename(title)}.{ext}"
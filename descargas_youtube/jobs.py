@@ -0,0 +1,323 @@
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import multiprocessing
+import os
+import threading
+
+from . import metrics
+
+CPU_WORKERS = int(os.environ.get("DESCARGAS_CPU_WORKERS", os.cpu_count() or 2))
+IO_WORKERS = int(os.environ.get("DESCARGAS_IO_WORKERS", 8))
+JOBS_PER_SESSION = int(os.environ.get("DESCARGAS_JOBS_PER_SESSION", 2))
+# Most items of one batch a session may download and analyze at once.
+BATCH_DOWNLOADS = int(os.environ.get("DESCARGAS_BATCH_DOWNLOADS", 4))
+# How often a caller attached to a shared job checks its own cancel token.
+CANCEL_POLL_SECONDS = 0.25
+# Run a warm-up analysis in every new worker process (and the server) at start.
+WARM_UP = os.environ.get("DESCARGAS_WARM_UP", "1") != "0"
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def shared_manager():
+    """The multiprocessing manager behind queues and events shared with worker processes."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = multiprocessing.get_context("spawn").Manager()
+        return _manager
+
+
+def _warm_worker():
+    # Imported here because analysis depends on this module.
+    from .analysis import warm_up
+
+    print(f"[arranque] Proceso de análisis {os.getpid()} preparado en {warm_up():.2f} s")
+
+
+class JobCancelled(Exception):
+    """Raised by a stage that noticed its job was cancelled."""
+
+
+class CancelToken:
+    """Cancellation flag checked by stages between units of work.
+
+    In the server process it is a plain ``threading.Event``; once the token
+    is pickled for a worker process it is backed by a manager ``Event`` as
+    well, so a cancel from the web session reaches the worker.
+    """
+
+    def __init__(self):
+        self._local = threading.Event()
+        self._shared = None
+        # The metrics job this token belongs to, if it was made by ``start_job``.
+        self.job = None
+
+    def __getstate__(self):
+        if self._shared is None:
+            self._shared = shared_manager().Event()
+            if self._local.is_set():
+                self._shared.set()
+        return {"_local": None, "_shared": self._shared, "job": self.job}
+
+    def cancel(self):
+        if self._local is not None:
+            self._local.set()
+        if self._shared is not None:
+            self._shared.set()
+
+    @property
+    def cancelled(self):
+        if self._local is not None and self._local.is_set():
+            return True
+        return self._shared is not None and self._shared.is_set()
+
+    def check(self):
+        if self.cancelled:
+            raise JobCancelled()
+
+
+def check(token):
+    """``token.check()`` for stages where the token is optional."""
+    if token is not None:
+        token.check()
+
+
+class _Ticket:
+    def __init__(self, session_id, kind, token, counted=True):
+        self.session_id = session_id
+        self.kind = kind
+        self.token = token
+        self.counted = counted
+        self.position = None
+        self.started = asyncio.Event()
+        self.moved = asyncio.Event()
+
+
+class JobScheduler:
+    """Runs blocking pipeline stages off the event loop, in FIFO order.
+
+    CPU-bound stages (decode, analysis, render) go to a process pool and
+    I/O-bound ones (yt-dlp downloads, file copies) to a thread pool. Each kind
+    has as many slots as its pool has workers, and a session holds at most
+    ``per_session`` slots at once so one user cannot starve the others.
+
+    Each session job (analysis, export, ...) gets a :class:`CancelToken` from
+    :meth:`start_job`; starting a new job under the same name cancels the old
+    one, and :meth:`cancel` stops everything a session has in flight.
+    """
+
+    def __init__(self, cpu_workers=CPU_WORKERS, io_workers=IO_WORKERS, per_session=JOBS_PER_SESSION):
+        self.limits = {"cpu": cpu_workers, "io": io_workers}
+        self.per_session = per_session
+        self._pools = {}
+        self._running = collections.Counter()
+        self._by_session = collections.Counter()
+        self._waiting = []
+        self._tokens = {}
+
+    def pool(self, kind):
+        if kind not in self._pools:
+            if kind == "cpu":
+                # Forking a server process that already runs threads is unsafe.
+                self._pools[kind] = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.limits["cpu"],
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_warm_worker if WARM_UP else None,
+                )
+            else:
+                self._pools[kind] = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.limits["io"],
+                    thread_name_prefix="descargas-io",
+                )
+        return self._pools[kind]
+
+    def queue_length(self):
+        return len(self._waiting)
+
+    async def start(self, kind="cpu"):
+        """Start every worker of ``kind`` now instead of on demand.
+
+        Process workers warm up as they start, so doing it ahead of traffic
+        keeps that cost off the first requests.
+        """
+        loop = asyncio.get_running_loop()
+        pool = self.pool(kind)
+        # Submitted together, so the pool has no idle worker to reuse and spawns them all.
+        await asyncio.gather(*(loop.run_in_executor(pool, os.getpid) for _ in range(self.limits[kind])))
+
+    def start_job(self, session_id, name, supersedes=()):
+        """Token for a new ``name`` job, cancelling the one it replaces and any in ``supersedes``."""
+        for other in (name, *supersedes):
+            self.cancel_token(self._tokens.pop((session_id, other), None))
+        token = self._tokens[(session_id, name)] = CancelToken()
+        # Stages the calling task runs from here on are timed under this job.
+        token.job = metrics.begin_job(name, session_id)
+        return token
+
+    def finish_job(self, session_id, name, token):
+        if self._tokens.get((session_id, name)) is token:
+            del self._tokens[(session_id, name)]
+        if token.job is not None:
+            metrics.registry.close_job(token.job, "cancelled" if token.cancelled else "ok")
+            token.job = None
+
+    def cancel(self, session_id):
+        for key in [key for key in self._tokens if key[0] == session_id]:
+            self.cancel_token(self._tokens.pop(key))
+
+    def cancel_token(self, token):
+        if token is None:
+            return
+        token.cancel()
+        # Wake its queued stages so they give up their place instead of waiting for a slot.
+        for ticket in self._waiting:
+            if ticket.token is token:
+                ticket.moved.set()
+
+    def _dispatch(self):
+        position = 0
+        for ticket in list(self._waiting):
+            if (self._running[ticket.kind] < self.limits[ticket.kind]
+                    and (not ticket.counted or self._by_session[ticket.session_id] < self.per_session)):
+                self._waiting.remove(ticket)
+                self._running[ticket.kind] += 1
+                if ticket.counted:
+                    self._by_session[ticket.session_id] += 1
+                ticket.started.set()
+                ticket.moved.set()
+            else:
+                position += 1
+                if ticket.position != position:
+                    ticket.position = position
+                    ticket.moved.set()
+
+    def _release(self, ticket):
+        self._running[ticket.kind] -= 1
+        if ticket.counted:
+            self._by_session[ticket.session_id] -= 1
+            if not self._by_session[ticket.session_id]:
+                del self._by_session[ticket.session_id]
+        self._dispatch()
+
+    async def run(self, session_id, fn, *args, kind="cpu", on_position=None, token=None, counted=True):
+        """Wait for a free slot, then run ``fn(*args)`` in the pool for ``kind``.
+
+        While the job is queued, ``on_position`` is awaited with its 1-based
+        place in the queue every time it changes, and once more with ``0``
+        when the job leaves the queue. Once ``token`` is cancelled the stage
+        leaves the queue, or its result is dropped, with :class:`JobCancelled`.
+        Stages that are not ``counted`` are exempt from ``per_session``.
+        """
+        ticket = _Ticket(session_id, kind, token, counted)
+        self._waiting.append(ticket)
+        self._dispatch()
+        try:
+            queued = False
+            while not ticket.started.is_set():
+                check(token)
+                queued = True
+                ticket.moved.clear()
+                if on_position is not None:
+                    await on_position(ticket.position)
+                if not ticket.started.is_set():
+                    await ticket.moved.wait()
+            if queued and on_position is not None:
+                await on_position(0)
+            check(token)
+            loop = asyncio.get_running_loop()
+            call = functools.partial(metrics.collect, metrics.current_job(), fn, *args)
+            try:
+                result, spans = await loop.run_in_executor(self.pool(kind), call)
+            except Exception as e:
+                metrics.registry.merge(getattr(e, "metric_spans", ()))
+                raise
+            metrics.registry.merge(spans)
+            check(token)
+            return result
+        finally:
+            if ticket.started.is_set():
+                self._release(ticket)
+            else:
+                self._waiting.remove(ticket)
+                self._dispatch()
+
+    async def map(self, session_id, fn, items, kind="cpu", token=None):
+        """Run ``fn(item)`` for every item in parallel; return the results in order.
+
+        This is the fan-out of a single job, so its stages take free workers
+        in FIFO order like any other but are not counted against the
+        session's ``per_session`` limit: one long track can use an idle pool.
+        """
+        return await asyncio.gather(*(
+            self.run(session_id, fn, item, kind=kind, token=token, counted=False) for item in items
+        ))
+
+
+class _Flight:
+    def __init__(self):
+        self.token = CancelToken()
+        self.subscribers = []
+        self.published = {}
+        self.task = None
+
+    async def publish(self, event):
+        self.published.update(event)
+        for subscriber in list(self.subscribers):
+            await subscriber(event)
+
+
+class SingleFlight:
+    """Runs one job per key, however many sessions ask for it at the same time.
+
+    The first caller for a key starts ``work(publish, token)``. Callers that
+    arrive while it runs attach to it instead: they get everything it has
+    published so far, then every later event, and the same result or
+    exception. The job has its own :class:`CancelToken`, cancelled only once
+    every attached caller has been cancelled.
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self._flights = {}
+
+    def __contains__(self, key):
+        return key in self._flights
+
+    def _start(self, key, work):
+        flight = self._flights[key] = _Flight()
+        flight.task = asyncio.ensure_future(work(flight.publish, flight.token))
+
+        def done(task):
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if not task.cancelled():
+                task.exception()  # Retrieved here too, in case every caller left.
+
+        flight.task.add_done_callback(done)
+        return flight
+
+    async def join(self, key, work, publish, token=None):
+        """Return the result of the job for ``key``, starting it if none is running."""
+        flight = self._flights.get(key)
+        if flight is None or flight.token.cancelled:
+            flight = self._start(key, work)
+        elif flight.published:
+            await publish(dict(flight.published))
+        flight.subscribers.append(publish)
+        try:
+            while not flight.task.done():
+                check(token)
+                await asyncio.wait([flight.task], timeout=CANCEL_POLL_SECONDS)
+            return flight.task.result()
+        finally:
+            flight.subscribers.remove(publish)
+            if not flight.subscribers and not flight.task.done():
+                self.scheduler.cancel_token(flight.token)
+
+
+scheduler = JobScheduler()
+flights = SingleFlight(scheduler)
@@ -0,0 +1,30 @@
+import importlib
+import threading
+import types
+
+
+class LazyModule(types.ModuleType):
+    """Stand-in for a module that is imported the first time it is used."""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                self._module = importlib.import_module(self.__name__)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+def lazy_import(name):
+    """Return module ``name``, imported only when one of its attributes is first read.
+
+    Keeps librosa, pygame and yt-dlp out of worker start and hot reloads;
+    the first access pays the import instead (see :func:`.analysis.warm_up`).
+    """
+    return LazyModule(name)
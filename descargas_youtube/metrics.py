@@ -0,0 +1,386 @@
+import collections
+import contextlib
+import contextvars
+import cProfile
+import http.server
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Port of the local /metrics endpoint; 0 turns it off.
+METRICS_PORT = int(os.environ.get("DESCARGAS_METRICS_PORT", 9464))
+# Jobs whose stages are profiled ("analysis,render", or "*" for all) and where the dumps go.
+PROFILE_JOBS = set(filter(None, os.environ.get("DESCARGAS_PROFILE_JOBS", "").split(",")))
+PROFILE_DIR = os.environ.get("DESCARGAS_PROFILE_DIR", os.path.join(os.getcwd(), "perfiles"))
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+TRACK_LENGTHS = ((60, "<1m"), (300, "1-5m"), (900, "5-15m"), (3600, "15-60m"))
+
+JobContext = collections.namedtuple("JobContext", "id name session_id profile_dir started")
+
+_job = contextvars.ContextVar("metrics_job", default=None)
+_buffer = contextvars.ContextVar("metrics_spans", default=None)
+_job_ids = itertools.count(1)
+
+# Linux lets a process reset its RSS high-water mark (VmHWM), so each span
+# can measure its own peak. Before every reset the mark is folded into the
+# spans still open and into the lifetime peak, so nothing is lost.
+_hwm_lock = threading.Lock()
+_open_spans = []
+_lifetime_peak = 0
+_can_reset = sys.platform.startswith("linux")
+
+
+def _read_hwm():
+    """VmHWM of this process in bytes, or None where it cannot be read."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _reset_hwm():
+    """Bring VmHWM down to the current RSS; False where the kernel does not allow it."""
+    global _can_reset
+    if _can_reset:
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            _can_reset = False
+    return _can_reset
+
+
+def _max_rss():
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def peak_rss():
+    """Peak resident memory of this process so far, in bytes (0 where unknown)."""
+    with _hwm_lock:
+        return max(_lifetime_peak, _max_rss(), _read_hwm() or 0)
+
+
+def _children_cpu():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    return ",".join(f'{key}="{_label_value(value)}"' for key, value in labels)
+
+
+def track_length_label(seconds):
+    if seconds is None:
+        return "unknown"
+    for limit, label in TRACK_LENGTHS:
+        if seconds < limit:
+            return label
+    return ">60m"
+
+
+class Span:
+    """Times one pipeline stage: wall and CPU time, peak RSS and bytes processed.
+
+    Use as ``with Span("decode") as span`` and fill in ``span.bytes`` and
+    ``span.track_seconds`` while it runs. CPU time is that of the calling
+    thread; ffmpeg's shows as ``child_cpu_seconds``, which is process-wide
+    and so only exact when no other stage runs in the same process; the same
+    goes for peak RSS, which is the process's highest RSS while the span was
+    open (on Linux; elsewhere it is the peak of the whole process so far).
+
+    With ``repeat`` the span is entered once per piece of work (a chunk, a
+    write) and adds them up; call :meth:`record` when the stage is done.
+    Spans recorded inside :func:`collect` travel back with its result,
+    the others go straight to :data:`registry`.
+    """
+
+    def __init__(self, stage, track_seconds=None, repeat=False):
+        self.stage = stage
+        self.track_seconds = track_seconds
+        self.repeat = repeat
+        self.bytes = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.child_cpu = 0.0
+        self.peak = 0
+        self.error = None
+
+    def __enter__(self):
+        global _lifetime_peak
+        with _hwm_lock:
+            hwm = _read_hwm()
+            if hwm is not None and _reset_hwm():
+                _lifetime_peak = max(_lifetime_peak, hwm)
+                for span in _open_spans:
+                    span.peak = max(span.peak, hwm)
+                _open_spans.append(self)
+        self._started = (time.perf_counter(), time.thread_time(), _children_cpu())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall, cpu, child_cpu = self._started
+        self.wall += time.perf_counter() - wall
+        self.cpu += time.thread_time() - cpu
+        self.child_cpu += _children_cpu() - child_cpu
+        with _hwm_lock:
+            if self in _open_spans:
+                _open_spans.remove(self)
+                self.peak = max(self.peak, _read_hwm() or 0)
+            else:
+                self.peak = max(self.peak, _max_rss())
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        if not self.repeat:
+            self.record()
+
+    def record(self):
+        job = _job.get()
+        span = {
+            'stage': self.stage,
+            'job': job.id if job else None,
+            'wall_seconds': round(self.wall, 4),
+            'cpu_seconds': round(self.cpu, 4),
+            'child_cpu_seconds': round(self.child_cpu, 4),
+            'peak_rss_bytes': self.peak or peak_rss(),
+            'bytes': self.bytes,
+            'track_seconds': None if self.track_seconds is None else round(self.track_seconds, 2),
+            'pid': os.getpid(),
+            'error': self.error,
+        }
+        buffer = _buffer.get()
+        if buffer is not None:
+            buffer.append(span)
+        else:
+            registry.record(span)
+
+
+def _callable_name(fn):
+    while hasattr(fn, "func"):
+        fn = fn.func
+    return getattr(fn, "__name__", "etapa")
+
+
+def collect(job, fn, *args):
+    """Run ``fn(*args)`` in a worker for ``job``; return ``(result, spans)``.
+
+    Worker threads and processes do not share the caller's context, so
+    this carries the job over and brings the spans back to be merged with
+    :meth:`MetricsRegistry.merge`. On failure the spans ride on the
+    exception as ``metric_spans``. Jobs with a ``profile_dir`` get a
+    cProfile dump of the call there.
+    """
+    spans = []
+    job_token, buffer_token = _job.set(job), _buffer.set(spans)
+    profiler = cProfile.Profile() if job is not None and job.profile_dir else None
+    try:
+        if profiler is not None:
+            profiler.enable()
+        try:
+            result = fn(*args)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                os.makedirs(job.profile_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(
+                    job.profile_dir, f"{job.id}-{_callable_name(fn)}-{os.getpid()}-{time.monotonic_ns()}.prof"
+                ))
+    except BaseException as e:
+        e.metric_spans = spans
+        raise
+    finally:
+        _buffer.reset(buffer_token)
+        _job.reset(job_token)
+    return result, spans
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, labels, value):
+        series = self._series.setdefault(labels, [0] * len(self.buckets) + [0, 0.0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += 1
+        series[-1] += value
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            label_text = _labels(labels)
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {series[-2]}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{{{label_text}}} {series[-2]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Aggregates spans into per-stage histograms and groups them by job.
+
+    Stages are labelled with their track length bucket (see
+    :data:`TRACK_LENGTHS`). Other modules can publish values of their own
+    with :meth:`gauge`; :meth:`expose` renders it all in the Prometheus
+    text format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.wall = Histogram("descargas_stage_wall_seconds", "Wall time per pipeline stage.")
+        self.cpu = Histogram("descargas_stage_cpu_seconds", "CPU time per pipeline stage, ffmpeg's included.")
+        self._bytes = collections.Counter()
+        self._errors = collections.Counter()
+        self._peak_rss = {}
+        self._gauges = []
+        self._jobs = {}
+
+    def record(self, span):
+        labels = (("stage", span['stage']), ("track_length", track_length_label(span['track_seconds'])))
+        with self._lock:
+            self.wall.observe(labels, span['wall_seconds'])
+            self.cpu.observe(labels, span['cpu_seconds'] + span['child_cpu_seconds'])
+            self._bytes[labels] += span['bytes']
+            if span['error']:
+                self._errors[labels] += 1
+            self._peak_rss[span['stage']] = max(self._peak_rss.get(span['stage'], 0), span['peak_rss_bytes'])
+            if span['job'] in self._jobs:
+                self._jobs[span['job']].append(span)
+
+    def merge(self, spans):
+        """Record spans brought back from a worker by :func:`collect`."""
+        for span in spans:
+            self.record(span)
+
+    def gauge(self, name, help, read, kind="gauge"):
+        """Expose ``read()`` as metric ``name`` on every scrape."""
+        self._gauges.append((name, help, read, kind))
+
+    def open_job(self, name, session_id=None, profile_dir=None):
+        """Start grouping the spans of a new job; return its :data:`JobContext`."""
+        if profile_dir is None and (name in PROFILE_JOBS or "*" in PROFILE_JOBS):
+            profile_dir = PROFILE_DIR
+        job = JobContext(f"{name}-{next(_job_ids)}", name, session_id, profile_dir or "", time.perf_counter())
+        with self._lock:
+            self._jobs[job.id] = []
+        return job
+
+    def close_job(self, job, status="ok"):
+        """Log one JSON line with every span of ``job``; return it."""
+        with self._lock:
+            spans = self._jobs.pop(job.id, [])
+        if status == "ok" and any(span['error'] for span in spans):
+            status = "error"
+        line = {
+            'job': job.name,
+            'id': job.id,
+            'session': job.session_id,
+            'status': status,
+            'wall_seconds': round(time.perf_counter() - job.started, 3),
+            'track_seconds': max((s['track_seconds'] for s in spans if s['track_seconds']), default=None),
+            'peak_rss_bytes': max((s['peak_rss_bytes'] for s in spans), default=0),
+            'stages': [
+                {key: s[key] for key in ('stage', 'wall_seconds', 'cpu_seconds', 'child_cpu_seconds', 'bytes', 'pid')}
+                for s in spans
+            ],
+        }
+        print("[métricas]", json.dumps(line, ensure_ascii=False))
+        return line
+
+    def expose(self):
+        with self._lock:
+            lines = self.wall.expose() + self.cpu.expose()
+            lines += ["# HELP descargas_stage_bytes_total Bytes processed per stage.",
+                      "# TYPE descargas_stage_bytes_total counter"]
+            for labels, total in sorted(self._bytes.items()):
+                lines.append(f"descargas_stage_bytes_total{{{_labels(labels)}}} {total}")
+            lines += ["# HELP descargas_stage_errors_total Stages that ended with an exception.",
+                      "# TYPE descargas_stage_errors_total counter"]
+            for labels, total in sorted(self._errors.items()):
+                lines.append(f"descargas_stage_errors_total{{{_labels(labels)}}} {total}")
+            lines += ["# HELP descargas_stage_peak_rss_bytes Highest process RSS seen during a stage.",
+                      "# TYPE descargas_stage_peak_rss_bytes gauge"]
+            for stage, peak in sorted(self._peak_rss.items()):
+                lines.append(f"descargas_stage_peak_rss_bytes{{{_labels((('stage', stage),))}}} {peak}")
+        for name, help, read, kind in self._gauges:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {read()}"]
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def current_job():
+    return _job.get()
+
+
+def begin_job(name, session_id=None):
+    """Open a job that stays current for the rest of the calling task."""
+    job = registry.open_job(name, session_id)
+    _job.set(job)
+    return job
+
+
+@contextlib.contextmanager
+def job(name, session_id=None, profile_dir=None):
+    """Group the spans of the enclosed work as one job; see :meth:`MetricsRegistry.open_job`."""
+    context = registry.open_job(name, session_id, profile_dir)
+    token = _job.set(context)
+    status = "ok"
+    try:
+        yield context
+    except BaseException as e:
+        status = "cancelled" if type(e).__name__ == "JobCancelled" else "error"
+        raise
+    finally:
+        _job.reset(token)
+        registry.close_job(context, status)
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.expose().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=METRICS_PORT, host="127.0.0.1"):
+    """Serve :data:`registry` at ``http://host:port/metrics`` from a daemon thread."""
+    server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="descargas-metrics", daemon=True).start()
+    return server
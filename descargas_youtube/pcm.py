@@ -0,0 +1,92 @@
+import json
+import os
+import subprocess
+import threading
+
+import numpy as np
+
+from .audio import FFMPEG
+from .jobs import JobCancelled
+from .metrics import Span
+
+PCM_SR = 44100
+PCM_CHANNELS = 2
+MAGIC = b"DYPCM1\n"
+HEADER_SIZE = 64
+
+
+def artifact_path(audio_file, suffix, work_dir=None):
+    """``audio_file`` with its extension replaced by ``suffix``, in ``work_dir`` or next to it."""
+    base = os.path.splitext(os.path.basename(audio_file))[0] + suffix
+    return os.path.join(work_dir or os.path.dirname(audio_file), base)
+
+
+def pcm_path(audio_file, work_dir=None):
+    """Where the decoded artifact of ``audio_file`` lives: right next to it unless ``work_dir`` is given."""
+    return artifact_path(audio_file, ".pcm", work_dir)
+
+
+def ensure_pcm(audio_file, token=None, work_dir=None):
+    """Decode ``audio_file`` to a PCM artifact once and return its path.
+
+    The artifact is interleaved int16 at ``PCM_SR`` after a fixed-size
+    header, written to a scratch name and renamed, so readers either see a
+    complete file or none. If ``token`` is cancelled mid-decode, ffmpeg is
+    killed and the scratch file removed.
+    """
+    path = pcm_path(audio_file, work_dir)
+    if os.path.exists(path):
+        return path
+    with Span("decode") as span:
+        header = json.dumps({"sr": PCM_SR, "channels": PCM_CHANNELS, "dtype": "int16"}).encode()
+        partial = f"{path}.{os.getpid()}-{threading.get_ident()}.part"
+        with open(partial, "wb") as f:
+            f.write((MAGIC + header).ljust(HEADER_SIZE, b" "))
+            f.flush()
+            # ffmpeg appends to the same descriptor, right after the header.
+            proc = subprocess.Popen(
+                [FFMPEG, "-v", "error", "-nostdin", "-i", audio_file, "-vn",
+                 "-ac", str(PCM_CHANNELS), "-ar", str(PCM_SR), "-f", "s16le", "-"],
+                stdout=f,
+                stderr=subprocess.PIPE,
+            )
+            while True:
+                try:
+                    _, stderr = proc.communicate(timeout=0.2)
+                    break
+                except subprocess.TimeoutExpired:
+                    if token is not None and token.cancelled:
+                        proc.kill()
+                        proc.communicate()
+                        os.unlink(partial)
+                        raise JobCancelled()
+        if proc.returncode != 0:
+            os.unlink(partial)
+            message = stderr.decode(errors="replace").strip()
+            raise Exception(f"ffmpeg no pudo procesar {os.path.basename(audio_file)}: {message}")
+        span.bytes = os.path.getsize(partial) - HEADER_SIZE
+        span.track_seconds = span.bytes / (PCM_SR * PCM_CHANNELS * 2)
+    os.replace(partial, path)
+    return path
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        raw = f.read(HEADER_SIZE)
+    if not raw.startswith(MAGIC):
+        raise Exception(f"{os.path.basename(path)} no es un archivo PCM válido")
+    return json.loads(raw[len(MAGIC):].decode().strip())
+
+
+def open_pcm(path):
+    """Memory-map a PCM artifact as a read-only ``(frames, channels)`` int16 array.
+
+    Pages are shared with every other process mapping the same file, so
+    several sessions on one track hold a single copy.
+    """
+    header = read_header(path)
+    channels = header["channels"]
+    frames = (os.path.getsize(path) - HEADER_SIZE) // (2 * channels)
+    if frames == 0:
+        return np.zeros((0, channels), dtype=np.int16)
+    return np.memmap(path, dtype=np.int16, mode="r", offset=HEADER_SIZE, shape=(frames, channels))
@@ -0,0 +1,135 @@
+import threading
+
+import numpy as np
+
+from .lazy import lazy_import
+from .pcm import PCM_SR
+from .render import click_samples, mix_grid, to_float, to_int16
+
+pygame = lazy_import("pygame")
+
+# Frames per audio callback: ~23 ms at 44.1 kHz, the bound on click jitter.
+BUFFER_FRAMES = 1024
+
+
+class Player:
+    """Plays a PCM artifact with the metronome mixed in at exact sample offsets.
+
+    :meth:`fill` is the whole mixer: it returns the next ``frames`` frames as
+    int16, clicks included, and advances the play position. It has no clock
+    of its own, so pause, resume and seek cannot drift from the clicks, and
+    it can be driven without any audio device. :meth:`open` hooks it to an
+    SDL audio device callback (``SDL_AUDIODRIVER=dummy`` works headless).
+    """
+
+    def __init__(self, pcm, grid, volume, sr=PCM_SR, buffer=BUFFER_FRAMES, pcm_file=None):
+        self.pcm = pcm
+        self.pcm_file = pcm_file
+        self.grid = grid
+        self.click = click_samples(volume, sr)
+        self.sr = sr
+        self.buffer = buffer
+        self.position = 0
+        self.paused = True
+        self.finished = threading.Event()
+        self.device = None
+        self._lock = threading.Lock()
+
+    @property
+    def seconds(self):
+        return self.position / self.sr
+
+    def fill(self, frames):
+        with self._lock:
+            channels = self.pcm.shape[1]
+            start = self.position
+            if self.paused or start >= len(self.pcm):
+                return np.zeros((frames, channels), dtype=np.int16)
+            window = np.zeros((frames, channels), dtype=np.float32)
+            chunk = to_float(self.pcm[start:start + frames])
+            window[:len(chunk)] = chunk
+            mix_grid(window, self.grid, self.click, start)
+            self.position = min(start + frames, len(self.pcm))
+            if self.position >= len(self.pcm):
+                self.paused = True
+                self.finished.set()
+            return to_int16(window)
+
+    def play(self):
+        with self._lock:
+            if self.position >= len(self.pcm):
+                self.position = 0
+            self.paused = False
+            self.finished.clear()
+
+    def pause(self):
+        with self._lock:
+            self.paused = True
+
+    def seek(self, seconds):
+        with self._lock:
+            self.position = max(0, min(int(seconds * self.sr), len(self.pcm)))
+            self.finished.clear()
+
+    def set_grid(self, grid):
+        with self._lock:
+            self.grid = grid
+
+    def set_volume(self, volume):
+        with self._lock:
+            self.click = click_samples(volume, self.sr)
+
+    def _callback(self, device, stream):
+        stream[:] = self.fill(len(stream) // (2 * self.pcm.shape[1])).tobytes()
+
+    def open(self):
+        """Start feeding the default output device from :meth:`fill`."""
+        from pygame._sdl2 import audio as sdl_audio
+        from pygame._sdl2 import sdl2
+
+        # Only the audio subsystem: the mixer would open the output device itself.
+        sdl2.init_subsystem(sdl2.INIT_AUDIO)
+        names = sdl_audio.get_audio_device_names(False)
+        if not names:
+            raise Exception("No hay ningún dispositivo de salida de audio.")
+        # The constructor takes positional arguments only, and a device name; the first is the default.
+        self.device = sdl_audio.AudioDevice(
+            names[0], False, self.sr, sdl_audio.AUDIO_S16, self.pcm.shape[1], self.buffer, 0, self._callback,
+        )
+        self.device.pause(0)
+        return self
+
+    def close(self):
+        self.pause()
+        if self.device is not None:
+            self.device.close()
+            self.device = None
+
+
+_players = {}
+_players_lock = threading.Lock()
+
+
+def get_player(session_id):
+    with _players_lock:
+        return _players.get(session_id)
+
+
+def open_player(session_id, pcm_file, pcm, grid, volume):
+    """The session's player for ``pcm_file``, replacing one playing another track."""
+    with _players_lock:
+        player = _players.get(session_id)
+        if player is not None and player.pcm_file == pcm_file:
+            return player
+        if player is not None:
+            player.close()
+        player = Player(pcm, grid, volume, pcm_file=pcm_file)
+        _players[session_id] = player.open()
+        return player
+
+
+def close_player(session_id):
+    with _players_lock:
+        player = _players.pop(session_id, None)
+    if player is not None:
+        player.close()
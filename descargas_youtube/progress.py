@@ -0,0 +1,120 @@
+import asyncio
+import threading
+import time
+
+from .jobs import shared_manager
+
+PUBLISH_RATE = 5.0
+
+
+def throttled(callback, interval=0.25):
+    """Wrap ``callback(fraction)`` so it fires at most once per ``interval`` seconds."""
+    last = [0.0]
+
+    def report(fraction):
+        now = time.monotonic()
+        if fraction >= 1 or now - last[0] >= interval:
+            last[0] = now
+            callback(fraction)
+
+    return report
+
+
+class ProgressBridge:
+    """Hands progress events from worker threads and processes to the event loop.
+
+    ``put`` is safe to call from any thread; events are dicts merged into one
+    pending update (later keys win), which ``publish`` receives on the event
+    loop at most ``max_rate`` times per second, plus a final flush on exit.
+    Worker processes get a queue from :meth:`process_queue` instead.
+    Use as ``async with ProgressBridge(publish) as bridge``.
+    """
+
+    def __init__(self, publish, max_rate=PUBLISH_RATE):
+        self.publish = publish
+        self.interval = 1.0 / max_rate
+        self._lock = threading.Lock()
+        self._pending = None
+        self._closed = False
+        self._queue = None
+        self._forwarder = None
+
+    async def __aenter__(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self._forwarder is not None:
+            self._queue.put(None)
+            await asyncio.to_thread(self._forwarder.join)
+        self._closed = True
+        self._wakeup.set()
+        await self._task
+
+    def put(self, event):
+        with self._lock:
+            first = self._pending is None
+            self._pending = {**(self._pending or {}), **event}
+        if first:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def ytdlp_hook(self):
+        """A yt-dlp progress hook reporting bytes, speed and ETA."""
+        def hook(d):
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            event = {'stage': 'download', 'downloaded': d.get('downloaded_bytes') or 0, 'total': total}
+            if d['status'] == 'downloading':
+                event.update(speed=d.get('speed'), eta=d.get('eta'))
+            elif d['status'] == 'finished':
+                event.update(downloaded=total or event['downloaded'], speed=None, eta=0)
+            self.put(event)
+        return hook
+
+    def stage_hook(self, stage):
+        """A ``callback(fraction)`` for in-process stages such as rendering."""
+        return lambda fraction: self.put({'stage': stage, 'fraction': fraction})
+
+    def process_queue(self):
+        """A queue that worker processes ``put`` events on; they are forwarded here."""
+        if self._queue is None:
+            self._queue = shared_manager().Queue()
+            self._forwarder = threading.Thread(target=self._forward, daemon=True)
+            self._forwarder.start()
+        return self._queue
+
+    def _forward(self):
+        while True:
+            event = self._queue.get()
+            if event is None:
+                return
+            self.put(event)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            with self._lock:
+                event, self._pending = self._pending, None
+            if event is not None:
+                await self.publish(event)
+            if self._closed:
+                return
+            await asyncio.sleep(self.interval)
+
+
+def _megabytes(n):
+    return f"{n / 1024 ** 2:.1f} MB"
+
+
+def describe_download(event):
+    """Human-readable summary of a download event, for the status line."""
+    parts = [_megabytes(event.get('downloaded') or 0)]
+    if event.get('total'):
+        parts[0] += f" / {_megabytes(event['total'])}"
+    if event.get('speed'):
+        parts.append(f"{_megabytes(event['speed'])}/s")
+    if event.get('eta'):
+        parts.append(f"quedan {int(event['eta'])} s")
+    return " · ".join(parts)
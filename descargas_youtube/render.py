@@ -0,0 +1,161 @@
+import collections
+import threading
+
+import numpy as np
+
+from .audio import export_stream
+from .jobs import check
+from .metrics import Span
+from .pcm import PCM_SR, ensure_pcm, open_pcm
+from .progress import throttled
+
+RENDER_SR = PCM_SR
+# Frames decoded, mixed and handed to the encoder per step (~10 s).
+CHUNK_SIZE = 10 * RENDER_SR
+PREVIEW_SECONDS = 10
+PREVIEW_CACHE_BYTES = 64 * 1024 ** 2
+# Beats mixed per vectorized step; progress is reported between steps.
+BEATS_PER_STEP = 2048
+
+
+def click_samples(volume, sr=RENDER_SR):
+    """The metronome click: a 20 ms 880 Hz blip at ``volume`` dB, as float32."""
+    n = int(sr * 0.020)
+    t = np.arange(n) / sr
+    envelope = np.ones(n)
+    fade_in, fade_out = int(sr * 0.005), int(sr * 0.015)
+    envelope[:fade_in] = np.linspace(0, 1, fade_in, endpoint=False)
+    envelope[n - fade_out:] = np.linspace(1, 0, fade_out)
+    gain = 10 ** (volume / 20)
+    return (np.sin(2 * np.pi * 880 * t) * envelope * gain).astype(np.float32)
+
+
+def mix_clicks(pcm, beat_times, click, sr=RENDER_SR, start=0, progress=None):
+    """Add ``click`` to ``pcm`` at every beat, in place.
+
+    ``pcm`` is a ``(frames, channels)`` float array whose first frame is
+    sample ``start`` of the track, so the same call mixes a whole track or any
+    window of it. Clicks that straddle the window edges are cut.
+    """
+    offsets = np.round(np.asarray(beat_times, dtype=np.float64) * sr).astype(np.int64) - start
+    offsets = offsets[(offsets > -len(click)) & (offsets < len(pcm))]
+    ramp = np.arange(len(click))
+    for first in range(0, len(offsets), BEATS_PER_STEP):
+        index = offsets[first:first + BEATS_PER_STEP, None] + ramp
+        inside = (index >= 0) & (index < len(pcm))
+        values = np.broadcast_to(click, index.shape)[inside]
+        # add.at keeps overlapping clicks additive, like repeated overlays did.
+        np.add.at(pcm, index[inside], values[:, None])
+        if progress is not None:
+            progress(min(1.0, (first + BEATS_PER_STEP) / len(offsets)))
+    return pcm
+
+
+def to_int16(pcm):
+    return (np.clip(pcm, -1.0, 1.0) * 32767).astype(np.int16)
+
+
+def to_float(pcm):
+    return pcm.astype(np.float32) / 32768.0
+
+
+def mix_grid(window, grid, click, start):
+    # Only the beats that can reach this window are ever materialized.
+    beat_times = grid.times((start - len(click)) / RENDER_SR, (start + len(window)) / RENDER_SR)
+    return mix_clicks(window, beat_times, click, start=start)
+
+
+def render_window(pcm, grid, volume, start=0, frames=None):
+    """Return ``frames`` frames of ``pcm`` from ``start`` on, with clicks, as int16."""
+    stop = len(pcm) if frames is None else min(len(pcm), start + frames)
+    window = to_float(pcm[start:stop])
+    mix_grid(window, grid, click_samples(volume), start)
+    return to_int16(window)
+
+
+def render_chunks(pcm, grid, volume, progress=None, token=None):
+    """Yield ``pcm`` with the clicks of ``grid`` mixed in, as int16 chunks.
+
+    ``pcm`` is normally a memory-mapped artifact, so memory use is one
+    ``CHUNK_SIZE`` chunk regardless of the track length. ``token`` is
+    checked before every chunk.
+    """
+    click = click_samples(volume)
+    report = throttled(progress) if progress is not None else None
+    # Only the mixing is timed here; the encoder's share is the "export" span.
+    mixing = Span("mix", track_seconds=len(pcm) / RENDER_SR, repeat=True)
+    try:
+        for start in range(0, len(pcm), CHUNK_SIZE):
+            check(token)
+            with mixing:
+                chunk = to_float(pcm[start:start + CHUNK_SIZE])
+                mix_grid(chunk, grid, click, start)
+                out = to_int16(chunk)
+                mixing.bytes += out.nbytes
+            if report is not None:
+                report(min(1.0, (start + len(chunk)) / len(pcm)))
+            yield out
+    finally:
+        mixing.record()
+
+
+def render_with_metronome(audio_file, grid, volume, outputs, progress=None, token=None):
+    """Mix the metronome into ``audio_file`` and encode it to every file in ``outputs``.
+
+    ``outputs`` maps an export format (see ``EXPORT_FORMATS``) to a path. If
+    ``token`` is cancelled the encoder is stopped and partial files removed.
+    """
+    pcm = open_pcm(ensure_pcm(audio_file, token))
+    with Span("render", track_seconds=len(pcm) / RENDER_SR) as span:
+        span.bytes = pcm.nbytes
+        chunks = render_chunks(pcm, grid, volume, progress, token)
+        return export_stream(chunks, outputs, RENDER_SR, pcm.shape[1])
+
+
+class PreviewCache:
+    """Rendered preview windows, least recently used evicted beyond ``max_bytes``."""
+
+    def __init__(self, max_bytes=PREVIEW_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._items = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            pcm = self._items.get(key)
+            if pcm is not None:
+                self._items.move_to_end(key)
+            return pcm
+
+    def put(self, key, pcm):
+        with self._lock:
+            if key in self._items:
+                self._bytes -= self._items.pop(key).nbytes
+            self._items[key] = pcm
+            self._bytes += pcm.nbytes
+            while self._bytes > self.max_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= evicted.nbytes
+        return pcm
+
+
+preview_cache = PreviewCache()
+
+
+def render_preview(pcm_file, grid, volume, start_seconds, key):
+    """Return ``PREVIEW_SECONDS`` of the track from ``start_seconds`` on, with clicks.
+
+    Only the pages of the window are read from the memory-mapped artifact.
+    Results are cached under ``key``, which must identify the track, the beat
+    grid, the volume and the window.
+    """
+    preview = preview_cache.get(key)
+    if preview is None:
+        pcm = open_pcm(pcm_file)
+        frames = min(PREVIEW_SECONDS * RENDER_SR, len(pcm))
+        start = max(0, min(int(start_seconds * RENDER_SR), len(pcm) - frames))
+        with Span("preview", track_seconds=len(pcm) / RENDER_SR) as span:
+            preview = preview_cache.put(key, render_window(pcm, grid, volume, start, frames))
+            span.bytes = preview.nbytes
+    return preview
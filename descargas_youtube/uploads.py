@@ -0,0 +1,168 @@
+import contextlib
+import hashlib
+import os
+import secrets
+import threading
+import time
+
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from .artifacts import QuotaExceeded, artifact_store
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.environ.get("DESCARGAS_MAX_UPLOAD_BYTES", 500 * 1024 ** 2))
+# Bytes needed to recognize every container in ``sniff_audio``.
+SNIFF_BYTES = 16
+# Backend route the browser posts the file body to, and how long a ticket for it stays valid.
+UPLOAD_ROUTE = "/subir_audio"
+TICKET_SECONDS = 60 * 60
+
+_tickets = {}
+_tickets_lock = threading.Lock()
+
+
+class UploadRejected(Exception):
+    """The upload is too large or is not audio; the message is shown to the user."""
+
+
+def sniff_audio(head):
+    """Return the container of ``head`` (the first bytes of a file) or ``None``."""
+    if head.startswith(b"ID3"):
+        return "mp3"
+    if head.startswith(b"fLaC"):
+        return "flac"
+    if head.startswith(b"OggS"):
+        return "ogg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    if head[:4] == b"FORM" and head[8:12] in (b"AIFF", b"AIFC"):
+        return "aiff"
+    if head[4:8] == b"ftyp":
+        return "m4a"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "webm"
+    if len(head) >= 2 and head[0] == 0xFF:
+        if head[1] & 0xF6 == 0xF0:
+            return "aac"
+        if head[1] & 0xE0 == 0xE0:
+            return "mp3"
+    return None
+
+
+def _too_large(max_bytes):
+    return UploadRejected(f"El archivo supera el límite de {max_bytes // 1024 ** 2} MB.")
+
+
+async def save_upload(chunks, filename, dest_dir, max_bytes=MAX_UPLOAD_BYTES, size=None):
+    """Write an upload arriving as ``chunks`` to ``dest_dir``, hashing as it goes.
+
+    ``chunks`` is an async iterable of bytes, normally the request body, so
+    the file is never whole in memory. The declared ``size`` is checked
+    before anything is read, the first bytes are sniffed before anything is
+    written, and the limit is enforced again on the bytes actually received.
+    Returns ``(path, sha256_hex)``.
+    """
+    if size is not None and size > max_bytes:
+        raise _too_large(max_bytes)
+    path = os.path.join(dest_dir, os.path.basename(filename or "audio"))
+    partial = path + ".part"
+    digest = hashlib.sha256()
+    received = 0
+    head = b""
+    try:
+        with open(partial, "wb") as out:
+            async for chunk in chunks:
+                received += len(chunk)
+                if received > max_bytes:
+                    raise _too_large(max_bytes)
+                if head is not None:
+                    head += chunk
+                    if len(head) < SNIFF_BYTES:
+                        continue
+                    if sniff_audio(head) is None:
+                        raise UploadRejected(f"{filename} no parece ser un archivo de audio.")
+                    chunk, head = head, None
+                digest.update(chunk)
+                out.write(chunk)
+            if received == 0:
+                raise UploadRejected(f"{filename} está vacío.")
+            if head is not None:
+                if sniff_audio(head) is None:
+                    raise UploadRejected(f"{filename} no parece ser un archivo de audio.")
+                digest.update(head)
+                out.write(head)
+    except BaseException:
+        # open() itself may be what failed.
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(partial)
+        raise
+    os.replace(partial, path)
+    return path, digest.hexdigest()
+
+
+def issue_ticket(session_id):
+    """A one-time ticket that lets the browser post one file for ``session_id`` to :data:`UPLOAD_ROUTE`."""
+    ticket = secrets.token_urlsafe(16)
+    now = time.time()
+    with _tickets_lock:
+        for stale in [t for t, entry in _tickets.items() if now - entry['issued'] > TICKET_SECONDS]:
+            result = _tickets.pop(stale).get('result') or {}
+            if result.get('dir'):
+                artifact_store.remove(result['dir'])
+        _tickets[ticket] = {'session_id': session_id, 'issued': now}
+    return ticket
+
+
+def take_upload(ticket, session_id):
+    """What :func:`receive_upload` stored for ``ticket``, once, or ``None`` if nothing arrived.
+
+    The result has ``path``, ``digest``, ``dir`` and ``filename``, or an
+    ``error`` to show the user.
+    """
+    with _tickets_lock:
+        entry = _tickets.get(ticket)
+        if entry is None or entry['session_id'] != session_id or 'result' not in entry:
+            return None
+        del _tickets[ticket]
+    return entry['result']
+
+
+async def receive_upload(request: Request):
+    """Backend route that streams a posted file into a new artifact directory.
+
+    Reflex's own upload route reads every file into memory before any
+    handler runs; this one writes the body to disk as it arrives. The
+    declared ``Content-Length`` is checked against the size limit and the
+    session's quota before the first byte is read. FastAPI needs the
+    annotation on ``request`` to pass it in.
+    """
+    ticket = request.query_params.get("ticket", "")
+    with _tickets_lock:
+        entry = _tickets.get(ticket)
+        if entry is None or entry.get('receiving'):
+            return JSONResponse({'error': "Subida no autorizada."}, status_code=403)
+        entry['receiving'] = True
+    filename = request.query_params.get("name") or "audio"
+    upload_dir = None
+    try:
+        try:
+            size = int(request.headers["content-length"])
+        except (KeyError, ValueError):
+            raise UploadRejected("El navegador no indicó el tamaño del archivo.")
+        if size > MAX_UPLOAD_BYTES:
+            raise _too_large(MAX_UPLOAD_BYTES)
+        upload_dir = artifact_store.create_dir(entry['session_id'], "subida", size)
+        path, digest = await save_upload(request.stream(), filename, upload_dir, size=size)
+    except (UploadRejected, QuotaExceeded) as e:
+        if upload_dir:
+            artifact_store.remove(upload_dir)
+        entry['result'] = {'error': str(e)}
+        return JSONResponse({'error': str(e)}, status_code=413)
+    except BaseException:
+        if upload_dir:
+            artifact_store.remove(upload_dir)
+        entry['result'] = {'error': "La subida se interrumpió."}
+        raise
+    entry['result'] = {'path': path, 'digest': digest, 'dir': upload_dir, 'filename': os.path.basename(path)}
+    return JSONResponse({'ok': True})
@@ -0,0 +1,118 @@
+import functools
+import os
+import threading
+
+import numpy as np
+
+from .pcm import PCM_SR, artifact_path
+
+# Audio frames per min/max pair at the finest level; each further level
+# groups PEAK_FACTOR pairs of the one below.
+PEAK_BUCKET = 256
+PEAK_FACTOR = 4
+PEAK_LEVELS = 5
+# Points sent to the browser per view.
+WAVEFORM_POINTS = 400
+
+
+def peaks_path(audio_file, work_dir=None):
+    return artifact_path(audio_file, ".peaks.npz", work_dir)
+
+
+class PeakBuilder:
+    """Collects min/max peaks of mono blocks as they stream past.
+
+    Blocks must be whole multiples of ``PEAK_BUCKET`` frames, except the last.
+    """
+
+    def __init__(self):
+        self._mins = []
+        self._maxs = []
+
+    def tap(self, blocks):
+        """Pass ``blocks`` through unchanged, recording their peaks on the way."""
+        for block in blocks:
+            self.add(block)
+            yield block
+
+    def add(self, block):
+        pad = -len(block) % PEAK_BUCKET
+        if pad:
+            block = np.concatenate([block, np.full(pad, block[-1], dtype=block.dtype)])
+        buckets = block.reshape(-1, PEAK_BUCKET)
+        self._mins.append(buckets.min(axis=1))
+        self._maxs.append(buckets.max(axis=1))
+
+    def save(self, path, onset_env, onset_rate):
+        """Write the peak pyramid and an 8-bit onset overview to ``path``.
+
+        Peaks are stored as int16 pairs, about 2.5 MB per hour of audio for
+        the finest level and a third of that for all the others together.
+        """
+        level = np.stack([np.concatenate(self._mins), np.concatenate(self._maxs)], axis=1)
+        arrays = {}
+        for i in range(PEAK_LEVELS):
+            arrays[f"level{i}"] = (np.clip(level, -1.0, 1.0) * 32767).astype(np.int16)
+            pad = -len(level) % PEAK_FACTOR
+            if pad:
+                level = np.concatenate([level, np.repeat(level[-1:], pad, axis=0)])
+            grouped = level.reshape(-1, PEAK_FACTOR, 2)
+            level = np.stack([grouped[:, :, 0].min(axis=1), grouped[:, :, 1].max(axis=1)], axis=1)
+        peak = float(onset_env.max()) or 1.0
+        onset = np.round(onset_env / peak * 255).astype(np.uint8)
+        # np.savez adds .npz to names without it, so the scratch name keeps it.
+        partial = f"{path}.{os.getpid()}-{threading.get_ident()}.part.npz"
+        np.savez(partial, onset=onset, onset_rate=onset_rate, **arrays)
+        os.replace(partial, path)
+        return path
+
+
+@functools.lru_cache(maxsize=8)
+def load_peaks(peaks_file):
+    """``({bucket_frames: peaks}, onset, onset_rate)`` of a stored pyramid."""
+    with np.load(peaks_file) as data:
+        levels = {PEAK_BUCKET * PEAK_FACTOR ** i: data[f"level{i}"] for i in range(PEAK_LEVELS)}
+        return levels, data["onset"], float(data["onset_rate"])
+
+
+def _reduce(values, n, fn):
+    edges = np.linspace(0, len(values), n + 1).astype(np.int64)[:-1]
+    return fn.reduceat(values, edges)
+
+
+def waveform_view(peaks_file, start, end, beat_times=(), width=WAVEFORM_POINTS, sr=PCM_SR):
+    """Chart points for seconds ``[start, end)`` of a track, at most ``width`` of them.
+
+    Reads the coarsest pyramid level that still has ``width`` pairs in the
+    window, so the cost of a view does not depend on the track length. Each
+    point has its time ``t``, ``min``/``max`` peaks in [-1, 1], the onset
+    strength in [0, 1] and ``beat`` set to 1 where a beat falls.
+    """
+    levels, onset, onset_rate = load_peaks(peaks_file)
+    span = (end - start) * sr
+    bucket = max((b for b in levels if span / b >= width), default=min(levels))
+    peaks = levels[bucket][int(start * sr // bucket):int(np.ceil(end * sr / bucket))]
+    if len(peaks) == 0:
+        return []
+    n = min(width, len(peaks))
+    mins = _reduce(peaks[:, 0], n, np.minimum) / 32767
+    maxs = _reduce(peaks[:, 1], n, np.maximum) / 32767
+    times = start + np.arange(n) * (end - start) / n
+
+    frames = onset[int(start * onset_rate):int(np.ceil(end * onset_rate))]
+    if len(frames) >= n:
+        strength = _reduce(frames, n, np.maximum) / 255
+    elif len(frames):
+        strength = frames[np.arange(n) * len(frames) // n] / 255
+    else:
+        strength = np.zeros(n)
+
+    beats = np.zeros(n)
+    beat_times = np.asarray(beat_times, dtype=np.float64)
+    inside = beat_times[(beat_times >= start) & (beat_times < end)]
+    beats[np.clip(np.searchsorted(times, inside, side="right") - 1, 0, n - 1)] = 1
+    return [
+        {'t': round(float(t), 2), 'min': round(float(lo), 3), 'max': round(float(hi), 3),
+         'onset': round(float(o), 3), 'beat': int(b)}
+        for t, lo, hi, o, b in zip(times, mins, maxs, strength, beats)
+    ]
@@ -0,0 +1,137 @@
+import functools
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("librosa")
+
+from benchmarks.synth import click_blocks, constant_beats, ramp_beats, ramp_tempo
+from descargas_youtube.analysis import (
+    ANALYSIS_SR, BLOCK_SIZE, HOP_LENGTH, _track, beat_agreement, load_onset, onset_envelope_stream, retrack,
+    segment_bounds, stitch_segments,
+)
+from descargas_youtube.beatgrid import BeatGrid
+
+FRAME_SECONDS = HOP_LENGTH / ANALYSIS_SR
+# Long enough to be split into three segments.
+SECONDS = 360
+# Stitched beats must agree this well with the reference (F-measure, 70 ms window).
+MIN_AGREEMENT = 0.95
+MIN_RAMP_AGREEMENT = 0.85
+# Local tempi are fitted to the tracked beats, so only a ramp within a segment moves them.
+TEMPO_TOLERANCE = 1
+
+
+def ramp_truth():
+    return ramp_beats(100, 130, SECONDS)
+
+
+def steady_beats():
+    return constant_beats(120, SECONDS)
+
+
+@functools.lru_cache(maxsize=None)
+def envelope(beats):
+    return onset_envelope_stream(click_blocks(beats(), SECONDS, ANALYSIS_SR, block_size=BLOCK_SIZE))
+
+
+def track_both(beats):
+    """Single-pass and stitched tracking of the same click track."""
+    onset_env = envelope(beats)
+    bounds = segment_bounds(len(onset_env))
+    assert len(bounds) > 1
+    single = _track(onset_env)
+    stitched = stitch_segments([_track(onset_env[lo:hi], offset=lo) for lo, hi in bounds], bounds)
+    return single, stitched
+
+
+def beat_seconds(result):
+    return np.asarray(result['beat_frames']) * FRAME_SECONDS
+
+
+def local_tempi(result):
+    """``(centre, bpm)`` of every entry of the tempo map, the centre being mid-way to the next one."""
+    tempo_map = result['tempo_map']
+    ends = [t for t, _ in tempo_map[1:]] + [SECONDS]
+    return [((t + end) / 2, bpm) for (t, bpm), end in zip(tempo_map, ends)]
+
+
+def test_beat_agreement():
+    beats = np.arange(0.5, 60, 0.5)
+    assert beat_agreement(beats, beats) == 1.0
+    assert beat_agreement(beats, beats + 0.05) == 1.0
+    assert beat_agreement(beats, beats + 0.1) == 0.0
+    assert beat_agreement(beats, beats[::2]) == pytest.approx(2 / 3, abs=0.01)
+    assert beat_agreement([], []) == 1.0
+    assert beat_agreement(beats, []) == 0.0
+
+
+def test_stitched_steady_tempo_matches_single_pass():
+    single, stitched = track_both(steady_beats)
+
+    assert beat_agreement(beat_seconds(single), beat_seconds(stitched)) >= MIN_AGREEMENT
+    assert beat_agreement(steady_beats(), beat_seconds(stitched)) >= MIN_AGREEMENT
+    for _, bpm in local_tempi(stitched):
+        assert abs(bpm - 120) <= TEMPO_TOLERANCE
+    assert single['tempo'] == pytest.approx(120, abs=0.05)
+    # No beat is duplicated or dropped at the seams.
+    assert np.all(np.diff(beat_seconds(stitched)) > 0.4)
+
+
+def test_stitched_ramp_follows_local_tempo():
+    truth = ramp_truth()
+    single, stitched = track_both(ramp_truth)
+
+    agreement = beat_agreement(truth, beat_seconds(stitched))
+    assert agreement >= MIN_RAMP_AGREEMENT
+    assert agreement >= beat_agreement(truth, beat_seconds(single)) - 0.02
+    for centre, bpm in local_tempi(stitched):
+        assert abs(bpm - ramp_tempo(100, 130, SECONDS, centre)) <= TEMPO_TOLERANCE
+
+
+def test_retrack_keeps_the_tempo_map(tmp_path):
+    _, stitched = track_both(ramp_truth)
+    onset_file = str(tmp_path / "ramp.onset.npz")
+    np.savez(onset_file, onset_env=envelope(ramp_truth), tempogram=np.zeros((1, 1)))
+    load_onset.cache_clear()
+    tempo_map = stitched['tempo_map']
+    grid = BeatGrid.from_beats(beat_seconds(stitched), tempo_map[0][1], SECONDS, tempo_map[1:])
+
+    doubled = retrack(onset_file, grid.scaled(2))
+
+    assert doubled.bpm == pytest.approx(2 * grid.bpm)
+    assert [bpm for _, bpm in doubled.changes] == pytest.approx([2 * bpm for _, bpm in grid.changes])
+    # Every restart lands on a tracked beat near the original change.
+    for (t, _), (original, _) in zip(doubled.changes, grid.changes):
+        assert abs(t - original) < 60 / grid.bpm
+    # And every beat of the original grid is still one of the doubled grid's.
+    distance = np.abs(np.subtract.outer(grid.times(), doubled.times())).min(axis=1)
+    assert np.mean(distance <= 0.07) >= MIN_RAMP_AGREEMENT
+
+
+def grid_of(result):
+    tempo_map = result.get('tempo_map') or [(0.0, result['tempo'])]
+    return BeatGrid.from_beats(beat_seconds(result), tempo_map[0][1], SECONDS, tempo_map[1:])
+
+
+def test_from_beats_fits_the_period():
+    beats = np.arange(0.31, 300, 0.5)
+    # A quantized estimate, a missed beat and some jitter.
+    tracked = np.delete(beats, 100) + np.random.default_rng(0).normal(0, 0.005, len(beats) - 1)
+
+    grid = BeatGrid.from_beats(tracked, 117.45, 300)
+
+    assert grid.bpm == pytest.approx(120, abs=0.01)
+    assert beat_agreement(beats, grid.times()) == 1.0
+
+
+def test_grid_follows_the_tracked_beats():
+    single, stitched = track_both(steady_beats)
+    for result in (single, stitched):
+        assert beat_agreement(steady_beats(), grid_of(result).times()) >= MIN_AGREEMENT
+
+    # A ramp cannot sit on a grid of constant stretches, but each stretch takes its mean tempo.
+    _, stitched = track_both(ramp_truth)
+    grid = grid_of(stitched)
+    for start, end, bpm, _ in grid.segments():
+        assert abs(bpm - ramp_tempo(100, 130, SECONDS, (start + end) / 2)) <= 1
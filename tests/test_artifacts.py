@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from descargas_youtube.artifacts import ArtifactStore, QuotaExceeded
+
+MB = 1024 ** 2
+# Makes a store under the given base, writes a file in it and prints its root.
+OTHER_PROCESS = textwrap.dedent("""
+    import sys
+    from descargas_youtube.artifacts import ArtifactStore
+    store = ArtifactStore(sys.argv[1], idle_seconds=0)
+    path = store.create_dir("otro", "descarga")
+    open(path + "/audio.webm", "wb").write(b"x")
+    print(store.root, flush=True)
+    sys.stdin.read()
+""")
+
+
+def other_process(base, **kwargs):
+    return subprocess.Popen(
+        [sys.executable, "-c", OTHER_PROCESS, str(base)], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), **kwargs,
+    )
+
+
+def test_sweep_keeps_the_directories_of_live_processes(tmp_path):
+    store = ArtifactStore(tmp_path, idle_seconds=0)
+    mine = store.create_dir("s", "subida")
+    live = other_process(tmp_path)
+    live_root = live.stdout.readline().strip()
+    try:
+        store.sweep()
+        assert os.path.exists(os.path.join(live_root, os.listdir(live_root)[0]))
+        assert os.path.isdir(mine)
+    finally:
+        live.communicate("")
+    # A clean exit removes its own directory.
+    assert not os.path.exists(live_root)
+
+
+def test_sweep_reaps_the_directories_of_dead_processes(tmp_path):
+    dead = other_process(tmp_path)
+    dead_root = dead.stdout.readline().strip()
+    dead.kill()
+    dead.wait()
+    assert os.path.isdir(dead_root)
+    store = ArtifactStore(tmp_path, idle_seconds=0)
+    store.create_dir("s")
+    store.sweep()
+    assert not os.path.exists(dead_root)
+    assert os.path.isdir(store.root)
+
+
+def test_reservations_count_against_the_quota(tmp_path):
+    store = ArtifactStore(tmp_path, max_bytes=10 * MB, session_max_bytes=10 * MB)
+    store.create_dir("a", "subida", 6 * MB)
+    # Nothing is written yet, but the first upload's promised bytes are taken.
+    with pytest.raises(QuotaExceeded):
+        store.create_dir("b", "subida", 6 * MB)
+    store.create_dir("b", "subida", 4 * MB)
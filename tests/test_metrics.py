@@ -0,0 +1,36 @@
+import pytest
+
+from descargas_youtube import metrics
+from descargas_youtube.metrics import MetricsRegistry, Span, collect, peak_rss
+
+MB = 1024 ** 2
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    registry.record({
+        'stage': 'a"b\\c\nd', 'job': None, 'wall_seconds': 0.1, 'cpu_seconds': 0.1, 'child_cpu_seconds': 0.0,
+        'peak_rss_bytes': 1, 'bytes': 0, 'track_seconds': None, 'error': None,
+    })
+    text = registry.expose()
+    assert 'stage="a\\"b\\\\c\\nd"' in text
+    assert 'a"b' not in text
+
+
+def test_peak_rss_is_per_span():
+    np = pytest.importorskip("numpy")
+    if metrics._read_hwm() is None or not metrics._reset_hwm():
+        pytest.skip("the RSS high-water mark cannot be reset here")
+    _, spans = collect(None, lambda: _two_spans(np))
+    big, small = spans
+    assert big['peak_rss_bytes'] - small['peak_rss_bytes'] > 150 * MB
+    # The lifetime peak survives the resets.
+    assert peak_rss() >= big['peak_rss_bytes']
+
+
+def _two_spans(np):
+    with Span("big"):
+        block = np.ones(200 * MB, dtype=np.uint8)
+        del block
+    with Span("small"):
+        np.ones(MB, dtype=np.uint8)
@@ -0,0 +1,130 @@
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from descargas_youtube.beatgrid import BeatGrid
+from descargas_youtube.playback import BUFFER_FRAMES, Player
+from descargas_youtube.render import click_samples, render_window
+
+SR = 44100
+VOLUME = 0
+
+
+def silence(seconds):
+    return np.zeros((int(seconds * SR), 2), dtype=np.int16)
+
+
+def noise(seconds):
+    rng = np.random.default_rng(0)
+    return rng.integers(-3000, 3000, (int(seconds * SR), 2)).astype(np.int16)
+
+
+def play(player, frames, buffer=BUFFER_FRAMES):
+    """Pull ``frames`` frames from ``player`` the way the audio callback does."""
+    chunks = [player.fill(min(buffer, frames - done)) for done in range(0, frames, buffer)]
+    return np.concatenate(chunks)
+
+
+def test_clicks_land_on_exact_sample_offsets():
+    # 120 BPM from 0.1 s on: clicks start at samples 4410, 26460, 48510...
+    grid = BeatGrid(120, 3, phase=0.1)
+    player = Player(silence(3), grid, VOLUME)
+    player.play()
+
+    out = play(player, 3 * SR)
+
+    click = click_samples(VOLUME)
+    expected = (np.clip(click, -1.0, 1.0) * 32767).astype(np.int16)
+    for beat in grid.times():
+        offset = int(round(beat * SR))
+        assert np.array_equal(out[offset:offset + len(click), 0], expected[:len(out) - offset])
+        assert np.array_equal(out[offset:offset + len(click), 1], expected[:len(out) - offset])
+    # Nothing but clicks: every other sample stays silent.
+    assert np.count_nonzero(out[:, 0]) == np.count_nonzero(np.tile(expected, len(grid.times())))
+
+
+def test_click_across_a_chunk_boundary():
+    # The click at frame 1000 runs past the end of the first 1024-frame buffer.
+    pcm = noise(2)
+    grid = BeatGrid(60, 2, phase=1000 / SR)
+    player = Player(pcm, grid, VOLUME)
+    player.play()
+
+    out = play(player, len(pcm))
+
+    assert 1000 + len(click_samples(VOLUME)) > BUFFER_FRAMES
+    assert np.array_equal(out, render_window(pcm, grid, VOLUME))
+
+
+def test_odd_buffer_sizes_match_the_render():
+    pcm = noise(2)
+    grid = BeatGrid(137, 2, phase=0.05)
+    player = Player(pcm, grid, VOLUME)
+    player.play()
+
+    assert np.array_equal(play(player, len(pcm), buffer=777), render_window(pcm, grid, VOLUME))
+
+
+def test_pause_and_seek_stay_in_sync():
+    pcm = noise(4)
+    grid = BeatGrid(120, 4, phase=0.2)
+    reference = render_window(pcm, grid, VOLUME)
+    player = Player(pcm, grid, VOLUME)
+    player.play()
+
+    first = play(player, SR // 2)
+    player.pause()
+    paused = play(player, SR // 4)
+    position = player.position
+    player.play()
+    resumed = play(player, SR // 2)
+
+    assert not paused.any()
+    assert position == SR // 2
+    assert np.array_equal(np.concatenate([first, resumed]), reference[:SR])
+
+    player.seek(2.5)
+    assert player.seconds == 2.5
+    assert np.array_equal(play(player, SR // 2), reference[int(2.5 * SR):3 * SR])
+
+    # Seeking while paused moves the position without producing anything.
+    player.pause()
+    player.seek(1.25)
+    assert not play(player, BUFFER_FRAMES).any()
+    player.play()
+    assert np.array_equal(play(player, BUFFER_FRAMES), reference[int(1.25 * SR):int(1.25 * SR) + BUFFER_FRAMES])
+
+
+def test_end_of_track_stops_and_rewinds_on_play():
+    pcm = noise(0.5)
+    player = Player(pcm, BeatGrid(120, 0.5), VOLUME)
+    player.play()
+
+    out = play(player, SR)
+
+    assert np.array_equal(out[:len(pcm)], render_window(pcm, player.grid, VOLUME))
+    assert not out[len(pcm):].any()
+    assert player.finished.is_set() and player.paused
+    player.play()
+    assert player.position == 0 and not player.finished.is_set()
+
+
+def test_dummy_audio_device_drives_the_player(monkeypatch):
+    pygame = pytest.importorskip("pygame")
+    pytest.importorskip("pygame._sdl2.audio")
+    monkeypatch.setenv("SDL_AUDIODRIVER", "dummy")
+    player = Player(noise(1), BeatGrid(120, 1), VOLUME)
+    try:
+        player.open()
+    except pygame.error as e:
+        pytest.skip(f"SDL has no dummy audio driver here: {e}")
+    try:
+        player.play()
+        deadline = time.monotonic() + 5
+        while player.position == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert player.position > 0
+    finally:
+        player.close()